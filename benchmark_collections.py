@@ -0,0 +1,374 @@
+import os.path
+import sys
+import csv
+import datetime
+import hashlib
+import random
+import shutil
+import subprocess
+import time
+
+# Settings for the synthetic collections: the seed for generating them (so every run benchmarks identical collections), the number of items in each collection and their sizes. Each collection holds many small files and a few large ones, named after the cataloguing convention it imitates; large files are LARGE_FILE_BYTES, or the multi-GB FULL_LARGE_FILE_BYTES when run with '--large-files'. Generating the collections needs roughly 4 x (SMALL_FILE_COUNT x the average small file size + LARGE_FILE_COUNT x the large file size) of free space, and nearly twice as much again for the copies made by the benchmarks.
+BENCHMARK_SEED = 681
+SMALL_FILE_COUNT = 2000
+SMALL_FILE_BYTES = (1024, 256 * 1024)
+LARGE_FILE_COUNT = 2
+LARGE_FILE_BYTES = 256 * 1024 * 1024
+FULL_LARGE_FILE_BYTES = 2 * 1024 * 1024 * 1024
+OPEX_FILE_BYTES = 2048
+
+# Settings for the synthetic manifests: the number of files listed in each of the two hash CSVs compared by the 'manifest' stage, which measures the memory used to compare folders of millions of files without generating them. One file in every MANIFEST_CHANGE_INTERVAL differs between the two CSVs (modified, moved or only in one).
+MANIFEST_ROWS = 1000000
+MANIFEST_CHANGE_INTERVAL = 100
+
+# Extensions of the content files in the synthetic collections, chosen at random for small files. Large files are always '.mov'.
+CONTENT_EXTENSIONS = ['tif', 'jpg', 'pdf', 'wav', 'docx']
+
+
+# Define key functions that will be executed in this script.
+
+# Locate the directory that the benchmark_collections.py is located in.
+def get_script_directory():
+    print('\n Locating script directory...')
+    return os.path.dirname(os.path.abspath(__file__))
+
+# Check that the paths given by the user actually exist.
+def check_path_exists(path: str):
+    print('\n Checking for existence of "' + path + "'...")
+    return os.path.exists(path)
+
+# Write a synthetic file of a given size. Content is generated from a seeded random block, varied for every file, so that no two files share content and every run writes identical files.
+def write_synthetic_file(file_path, size, rng):
+    block = rng.randbytes(min(size, 1024 * 1024))
+    with open(file_path, 'wb') as f:
+        written = 0
+        while written < size:
+            chunk = block[:size - written]
+            f.write(chunk)
+            written += len(chunk)
+            block = block[1:] + block[:1]
+
+# Return the sizes of the content files in a collection: SMALL_FILE_COUNT small files followed by LARGE_FILE_COUNT large files.
+def get_content_sizes(rng):
+    return ([rng.randint(*SMALL_FILE_BYTES) for _ in range(SMALL_FILE_COUNT)]
+            + [LARGE_FILE_BYTES] * LARGE_FILE_COUNT)
+
+# Generate a TMS collection. Items are numbered within accessions (e.g. PH.681.1), and each item has one to three files, with multiple files distinguished by a letter (e.g. PH.681.1a.tif, PH.681.1b.jpg). For the Standard structure every item has its own OPEX file; for the PAX structure, items in every third run of three share a ranged OPEX file (e.g. PH.681.4-6.opex).
+def generate_tms_collection(folder_path, rng, ranged_opex):
+    item_files = []
+    for size in get_content_sizes(rng):
+        if not item_files or len(item_files[-1]) == 3 or rng.random() < 0.5:
+            item_files.append([])
+        item_files[-1].append(size)
+
+    for index, sizes in enumerate(item_files):
+        accession, number = divmod(index, 500)
+        prefix = f'PH.{681 + accession}.{number + 1}'
+        for letter, size in zip('abc', sizes):
+            suffix = letter if len(sizes) > 1 else ''
+            extension = 'mov' if size == LARGE_FILE_BYTES else rng.choice(CONTENT_EXTENSIONS)
+            write_synthetic_file(os.path.join(folder_path, f'{prefix}{suffix}.{extension}'), size, rng)
+
+        if not ranged_opex or number % 6 >= 3:
+            write_synthetic_file(os.path.join(folder_path, f'{prefix}.opex'), OPEX_FILE_BYTES, rng)
+        elif number % 6 == 0:
+            last = min(number + 3, 500, len(item_files) - accession * 500)
+            write_synthetic_file(os.path.join(folder_path, f'PH.{681 + accession}.{number + 1}-{last}.opex'), OPEX_FILE_BYTES, rng)
+
+# Generate a Koha collection. Items are numeric barcodes (e.g. 12345), each with one or two files (e.g. 12345a.tif, 12345b.pdf) and an OPEX file.
+def generate_koha_collection(folder_path, rng):
+    item_files = []
+    for size in get_content_sizes(rng):
+        if not item_files or len(item_files[-1]) == 2 or rng.random() < 0.5:
+            item_files.append([])
+        item_files[-1].append(size)
+
+    for index, sizes in enumerate(item_files):
+        prefix = str(10000 + index * 7)
+        for letter, size in zip('ab', sizes):
+            suffix = letter if len(sizes) > 1 else ''
+            extension = 'mov' if size == LARGE_FILE_BYTES else rng.choice(CONTENT_EXTENSIONS)
+            write_synthetic_file(os.path.join(folder_path, f'{prefix}{suffix}.{extension}'), size, rng)
+        write_synthetic_file(os.path.join(folder_path, f'{prefix}.opex'), OPEX_FILE_BYTES, rng)
+
+# Generate a Calm collection of files named after their place in the archival hierarchy (e.g. CAMB-1-17-2-2.tif), with a few top-level files (e.g. CAMB-2.pdf).
+def generate_calm_collection(folder_path, rng):
+    for index, size in enumerate(get_content_sizes(rng)):
+        extension = 'mov' if size == LARGE_FILE_BYTES else rng.choice(CONTENT_EXTENSIONS)
+        if index % 50 == 49:
+            reference = f'CAMB-{index // 50 + 1}'
+        else:
+            series, remainder = divmod(index, 400)
+            file, item = divmod(remainder, 20)
+            reference = f'CAMB-{series + 1}-{file + 1}-{item % 4 + 1}-{item // 4 + 1}'
+        write_synthetic_file(os.path.join(folder_path, f'{reference}.{extension}'), size, rng)
+
+# Generate all synthetic collections, and the synthetic hash CSVs, under a working folder, returning a dictionary of their paths keyed by name.
+def generate_collections(work_dir):
+    rng = random.Random(BENCHMARK_SEED)
+    collections = {}
+    for name, generate in [('tms_std', lambda path: generate_tms_collection(path, rng, ranged_opex=False)),
+                           ('tms_pax', lambda path: generate_tms_collection(path, rng, ranged_opex=True)),
+                           ('koha', lambda path: generate_koha_collection(path, rng)),
+                           ('calm', lambda path: generate_calm_collection(path, rng))]:
+        collections[name] = os.path.join(work_dir, 'collections', name)
+        shutil.rmtree(collections[name], ignore_errors=True)
+        os.makedirs(collections[name])
+        generate(collections[name])
+    collections['manifests'] = generate_manifests(work_dir)
+    return collections
+
+# Generate two synthetic hash CSVs of MANIFEST_ROWS files each, laid out like those written by compare_hashes.py, under a working folder, returning the folder they are in. Files are spread over accession and item folders, and every MANIFEST_CHANGE_INTERVAL files one is modified, moved or removed in the second CSV, or added to it.
+def generate_manifests(work_dir):
+    import compare_hashes
+    rng = random.Random(BENCHMARK_SEED)
+    folder_path = os.path.join(work_dir, 'collections', 'manifests')
+    os.makedirs(folder_path, exist_ok=True)
+    digest_sizes = [hashlib.new(algorithm).digest_size for algorithm in compare_hashes.HASH_ALGORITHMS]
+    header = ['Relative_Path'] + [f'{compare_hashes.hash_label(algorithm)}_Hash' for algorithm in compare_hashes.HASH_ALGORITHMS]
+
+    with open(os.path.join(folder_path, 'hashes_1.csv'), 'w', newline='', encoding='utf-8') as f1, \
+            open(os.path.join(folder_path, 'hashes_2.csv'), 'w', newline='', encoding='utf-8') as f2:
+        writer1, writer2 = csv.writer(f1), csv.writer(f2)
+        writer1.writerow(header)
+        writer2.writerow(header)
+        for index in range(MANIFEST_ROWS):
+            accession, number = divmod(index, 5000)
+            relative_path = os.path.join(f'PH.{681 + accession}', f'Item_{number // 50 + 1}', f'PH.{681 + accession}.{number + 1}.tif')
+            hashes = [rng.randbytes(size).hex() for size in digest_sizes]
+            writer1.writerow([relative_path] + hashes)
+
+            change = index % MANIFEST_CHANGE_INTERVAL
+            if change == 1:
+                writer2.writerow([relative_path] + [rng.randbytes(size).hex() for size in digest_sizes])
+            elif change == 2:
+                writer2.writerow([relative_path.replace('.tif', '_moved.tif')] + hashes)
+            elif change == 3:
+                writer2.writerow([relative_path] + hashes)
+                writer2.writerow([relative_path.replace('.tif', '_added.tif')] + [rng.randbytes(size).hex() for size in digest_sizes])
+            elif change != 4:
+                writer2.writerow([relative_path] + hashes)
+    return folder_path
+
+# Return the number of files and bytes held in a folder.
+def measure_folder(folder_path):
+    file_count = 0
+    total_bytes = 0
+    for root, _, files in os.walk(folder_path):
+        for f in files:
+            file_count += 1
+            total_bytes += os.path.getsize(os.path.join(root, f))
+    return file_count, total_bytes
+
+# Return the benchmark stages in the order they run, as (programme, stage, collection, runner) tuples. Each runner takes the working folder and the collection path and runs its stage. Stages that depend on earlier ones (e.g. comparing the copy made by safe_copy.py) rely on this order. Calm material has no OPEX files to validate, so its handlers only have a 'copy' stage.
+def get_stages():
+    stages = [
+        ('safe_copy.py', 'copy', 'tms_pax', run_safe_copy),
+        ('safe_copy.py', 'resume', 'tms_pax', run_safe_copy_resume),
+        ('compare_hashes.py', 'hash', 'tms_pax', run_compare_hash),
+        ('compare_hashes.py', 'compare', 'tms_pax', run_compare_compare),
+        ('compare_hashes.py', 'manifest', 'manifests', run_compare_manifest),
+        ('compare_hashes.py', 'external', 'manifests', run_compare_manifest_external),
+        ('compare_hashes.py', 'dedup', 'tms_pax', run_compare_dedup),
+    ]
+    for catalogue, structure, collection in [('TMS', 'Standard', 'tms_std'), ('TMS', 'PAX', 'tms_pax'),
+                                             ('Koha', 'Standard', 'koha'), ('Koha', 'PAX', 'koha'),
+                                             ('Calm', 'Standard', 'calm'), ('Calm', 'PAX', 'calm')]:
+        programme = f'structure_SIPs.py {catalogue} {structure}'
+        if catalogue != 'Calm':
+            stages.append((programme, 'validate', collection, run_structure_validate))
+        stages.append((programme, 'copy', collection, run_structure_copy))
+    return stages
+
+# Return a new, empty output folder for a stage.
+def get_output_folder(work_dir, name):
+    folder_path = os.path.join(work_dir, 'output', name)
+    shutil.rmtree(folder_path, ignore_errors=True)
+    os.makedirs(folder_path)
+    return folder_path
+
+# Run the secure copy of safe_copy.py, journaling every copy.
+def run_safe_copy(work_dir, collection, catalogue=None, structure=None):
+    import safe_copy
+    destination = get_output_folder(work_dir, 'safe_copy')
+    safe_copy.open_copy_journal(os.path.join(work_dir, 'safe_copy_journal.csv'), False)
+    try:
+        safe_copy.secure_copy(collection, destination, os.path.join(work_dir, 'safe_copy_log.csv'))
+    finally:
+        safe_copy.close_copy_journal()
+
+# Resume the secure copy of safe_copy.py from the journal of its 'copy' stage, which finds every file already copied.
+def run_safe_copy_resume(work_dir, collection, catalogue=None, structure=None):
+    import safe_copy
+    destination = os.path.join(work_dir, 'output', 'safe_copy')
+    safe_copy.open_copy_journal(os.path.join(work_dir, 'safe_copy_journal.csv'), True)
+    try:
+        safe_copy.secure_copy(collection, destination, os.path.join(work_dir, 'safe_copy_resume_log.csv'))
+    finally:
+        safe_copy.close_copy_journal()
+
+# Run the hash CSV generation of compare_hashes.py, comparing the collection with the copy made by safe_copy.py.
+def run_compare_hash(work_dir, collection, catalogue=None, structure=None):
+    import compare_hashes
+    copy = os.path.join(work_dir, 'output', 'safe_copy')
+    compare_hashes.write_both_hashes_to_csv(collection, os.path.join(work_dir, 'hashes_1.csv'), copy, os.path.join(work_dir, 'hashes_2.csv'))
+
+# Run the comparison of the hash CSVs written by the 'hash' stage of compare_hashes.py.
+def run_compare_compare(work_dir, collection, catalogue=None, structure=None):
+    import compare_hashes
+    compare_hashes.folder_1 = collection
+    compare_hashes.folder_2 = os.path.join(work_dir, 'output', 'safe_copy')
+    evaluation = compare_hashes.compare_hash_csvs(os.path.join(work_dir, 'hashes_1.csv'), os.path.join(work_dir, 'hashes_2.csv'))
+    compare_hashes.write_hash_comparison_to_csv(evaluation, os.path.join(work_dir, 'comparison_report.csv'))
+
+# Run the comparison of the synthetic hash CSVs, which stands for comparing two folders of MANIFEST_ROWS files each.
+def run_compare_manifest(work_dir, collection, catalogue=None, structure=None):
+    import compare_hashes
+    compare_hashes.folder_1 = 'manifest_1'
+    compare_hashes.folder_2 = 'manifest_2'
+    evaluation = compare_hashes.compare_hash_csvs(os.path.join(collection, 'hashes_1.csv'), os.path.join(collection, 'hashes_2.csv'))
+    compare_hashes.write_hash_comparison_to_csv(evaluation, os.path.join(work_dir, 'manifest_report.csv'))
+
+# Run the comparison of the synthetic hash CSVs with both sorted on disk, as compare_hashes.py does with '--external-sort'.
+def run_compare_manifest_external(work_dir, collection, catalogue=None, structure=None):
+    import compare_hashes
+    compare_hashes.folder_1 = 'manifest_1'
+    compare_hashes.folder_2 = 'manifest_2'
+    evaluation = compare_hashes.compare_hash_csvs_external(os.path.join(collection, 'hashes_1.csv'), os.path.join(collection, 'hashes_2.csv'))
+    compare_hashes.write_hash_comparison_to_csv(evaluation, os.path.join(work_dir, 'manifest_external_report.csv'))
+
+# Run the content-dedup mode of compare_hashes.py over the collection and its copy.
+def run_compare_dedup(work_dir, collection, catalogue=None, structure=None):
+    import compare_hashes
+    duplicates = compare_hashes.find_duplicates(collection, os.path.join(work_dir, 'output', 'safe_copy'))
+    compare_hashes.write_duplicates_to_csv(duplicates, os.path.join(work_dir, 'duplicates_report.csv'))
+
+# Import structure_SIPs.py, adding its folder to the module search path so that its handlers can be imported too.
+def import_structure_sips():
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stucture_SIP_folders'))
+    import structure_SIPs
+    return structure_SIPs
+
+# Run the OPEX validation of a structure_SIPs.py handler.
+def run_structure_validate(work_dir, collection, catalogue, structure):
+    structure_SIPs = import_structure_sips()
+    files = [entry.path for entry in structure_SIPs.walk_files(collection)]
+    if catalogue == 'TMS' and structure == 'Standard':
+        structure_SIPs.validate_tms_std(collection, files)
+    elif catalogue == 'TMS' and structure == 'PAX':
+        structure_SIPs.validate_tms_pax(collection, files)
+    elif catalogue == 'Koha' and structure == 'Standard':
+        structure_SIPs.validate_koha_std(collection, files)
+    elif catalogue == 'Koha' and structure == 'PAX':
+        structure_SIPs.validate_koha_pax(collection, files)
+
+# Run the secure copy of a structure_SIPs.py handler into a new output folder.
+def run_structure_copy(work_dir, collection, catalogue, structure):
+    import_structure_sips()
+    import tms_std, tms_pax, koha_std, koha_pax, calm_std, calm_pax
+    destination = get_output_folder(work_dir, f'{catalogue}_{structure}')
+    handlers = {
+        ('TMS', 'Standard'): tms_std.secure_copy,
+        ('TMS', 'PAX'): tms_pax.secure_copy,
+        ('Koha', 'Standard'): koha_std.secure_copy,
+        ('Koha', 'PAX'): koha_pax.secure_copy,
+        ('Calm', 'Standard'): calm_std.secure_copy,
+        ('Calm', 'PAX'): calm_pax.secure_copy,
+    }
+    handlers[(catalogue, structure)](collection, destination, os.path.join(work_dir, f'{catalogue}_{structure}_log.csv'))
+
+# Run a single stage in this process and print the time it took. This is what each benchmark child process runs.
+def run_stage(index, work_dir):
+    programme, _, collection, runner = get_stages()[index]
+    catalogue, structure = programme.split()[1:] if programme.startswith('structure_SIPs.py') else (None, None)
+    start = time.perf_counter()
+    runner(work_dir, os.path.join(work_dir, 'collections', collection), catalogue, structure)
+    print(f'elapsed={time.perf_counter() - start}')
+
+# Run a stage in a child process, so that the peak memory use of each programme and stage is measured separately, returning the time it took in seconds and its peak RSS in MB (or None where this cannot be measured).
+def benchmark_stage(index, work_dir):
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--stage', str(index), work_dir],
+                               stdout=subprocess.PIPE, text=True)
+    output = process.stdout.read()
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(process.pid, 0)
+        return_code = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+        peak_rss = usage.ru_maxrss / (1000000 if sys.platform == 'darwin' else 1000)
+    else:
+        return_code = process.wait()
+        peak_rss = None
+    if return_code != 0:
+        sys.exit(f'\nStage {index} failed with exit code {return_code}:\n{output}')
+    elapsed = float(output.strip().splitlines()[-1].split('=')[1])
+    return elapsed, peak_rss
+
+# Run every stage, returning a row of results for each.
+def run_benchmarks(work_dir, collections):
+    results = []
+    for index, (programme, stage, collection, _) in enumerate(get_stages()):
+        file_count, total_bytes = measure_folder(collections[collection])
+        # Stages of compare_hashes.py cover both the collection and its copy, and those comparing the synthetic hash CSVs the files listed in both.
+        if collection == 'manifests':
+            file_count = MANIFEST_ROWS * 2
+        elif programme == 'compare_hashes.py':
+            file_count, total_bytes = file_count * 2, total_bytes * 2
+        print(f' Running {programme} ({stage})...')
+        elapsed, peak_rss = benchmark_stage(index, work_dir)
+        results.append({
+            'Programme': programme,
+            'Stage': stage,
+            'Files': file_count,
+            'MB': round(total_bytes / 1000000, 1),
+            'Seconds': round(elapsed, 3),
+            'Files_per_second': round(file_count / elapsed, 1) if elapsed else '',
+            'MB_per_second': round(total_bytes / 1000000 / elapsed, 1) if elapsed else '',
+            'Peak_RSS_MB': round(peak_rss, 1) if peak_rss is not None else ''
+        })
+    return results
+
+# Write benchmark results to a CSV log, so that runs can be compared to catch regressions.
+def write_results_to_csv(results, output_path):
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+
+###############################################
+# Execution of functions using user-specified paths occurs below, provided the user supplies a valid path. Benchmark child processes are started with '--stage' and only run their stage.
+
+if __name__ == '__main__':
+    if '--stage' in sys.argv:
+        stage_index, stage_work_dir = sys.argv[sys.argv.index('--stage') + 1:][:2]
+        run_stage(int(stage_index), stage_work_dir)
+        sys.exit(0)
+
+    # Get user variables (folder name).
+    work_folder = str(input('Enter path of a working folder for the synthetic collections and their copies: ').strip())
+
+    if check_path_exists(work_folder):
+        if '--large-files' in sys.argv:
+            LARGE_FILE_BYTES = FULL_LARGE_FILE_BYTES
+        print('\n Generating synthetic collections...')
+        synthetic_collections = generate_collections(work_folder)
+
+        print('\n Running benchmarks, one programme and stage at a time...')
+        benchmark_results = run_benchmarks(work_folder, synthetic_collections)
+
+        # Set up folder and its location to write CSV log to.
+        logs_dir = os.path.join(get_script_directory(), 'benchmark_logs')
+        os.makedirs(logs_dir, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%d-%m-%Y_%H-%M-%S")
+        results_file = os.path.join(logs_dir, f'benchmark_{timestamp}.csv')
+        write_results_to_csv(benchmark_results, results_file)
+
+        print(f"\n {'Programme':<32} {'Stage':<10} {'Files':>8} {'MB':>10} {'Files/s':>10} {'MB/s':>10} {'Peak RSS MB':>12}")
+        for row in benchmark_results:
+            print(f" {row['Programme']:<32} {row['Stage']:<10} {row['Files']:>8} {row['MB']:>10} "
+                  f"{row['Files_per_second']:>10} {row['MB_per_second']:>10} {row['Peak_RSS_MB']:>12}")
+        print(f'\n Results written to {results_file}')
+
+    else:
+        print('\n Folder path is invalid. Exiting...')
+        sys.exit(1)
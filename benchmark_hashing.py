@@ -0,0 +1,64 @@
+import os.path
+import sys
+import time
+import compare_hashes
+from compare_hashes import check_path_exists, walk_files, generate_hashes
+
+# Settings for the benchmark: the number of times each strategy hashes the sample files (the fastest pass is reported) and the buffer size used by the baseline, which reads the way the scripts did before reads were configurable.
+BENCHMARK_REPEATS = 3
+BASELINE_BUFFER_SIZE = 4096
+
+
+# Define key functions that will be executed in this script.
+
+# Return the read strategies to compare as (label, strategy, buffer size) tuples.
+def get_strategies():
+    return [
+        (f'read, {BASELINE_BUFFER_SIZE // 1024} KiB chunks (baseline)', 'read', BASELINE_BUFFER_SIZE),
+        (f'read, {compare_hashes.HASH_BUFFER_SIZE // 1024} KiB chunks', 'read', compare_hashes.HASH_BUFFER_SIZE),
+        (f'readinto, {compare_hashes.HASH_BUFFER_SIZE // 1024} KiB buffer', 'readinto', compare_hashes.HASH_BUFFER_SIZE),
+        (f'mmap, {compare_hashes.HASH_BUFFER_SIZE // 1024} KiB views', 'mmap', compare_hashes.HASH_BUFFER_SIZE),
+    ]
+
+# Hash every file with one strategy and buffer size, returning the time taken in seconds.
+def time_strategy(file_list, strategy, buffer_size):
+    compare_hashes.HASH_BUFFER_SIZE = buffer_size
+    start = time.perf_counter()
+    for file_path in file_list:
+        generate_hashes(file_path, strategy)
+    return time.perf_counter() - start
+
+# Hash the sample files with each strategy, returning (label, MB/s) tuples. Every file is read once beforehand, and kept in the page cache, so that no strategy benefits from files cached by an earlier one.
+def benchmark_strategies(file_list):
+    total_bytes = sum(os.path.getsize(file_path) for file_path in file_list)
+    compare_hashes.DROP_CACHE_AFTER_READ = False
+    default_buffer_size = compare_hashes.HASH_BUFFER_SIZE
+    time_strategy(file_list, 'read', default_buffer_size)
+
+    results = []
+    for label, strategy, buffer_size in get_strategies():
+        fastest = min(time_strategy(file_list, strategy, buffer_size) for _ in range(BENCHMARK_REPEATS))
+        results.append((label, total_bytes / 1000000 / fastest if fastest else 0.0))
+    compare_hashes.HASH_BUFFER_SIZE = default_buffer_size
+    return total_bytes, results
+
+
+###############################################
+# Execution of functions using user-specified paths occurs below, provided the user supplies a valid path.
+
+if __name__ == '__main__':
+    # Get user variables (folder name).
+    sample = str(input('Enter path of a folder of sample files to hash: ').strip())
+
+    if check_path_exists(sample):
+        files = [entry.path for entry in walk_files(sample)]
+        print(f"\n Hashing {len(files)} files with {', '.join(compare_hashes.HASH_ALGORITHMS)}, fastest of {BENCHMARK_REPEATS} passes per strategy...")
+        total_bytes, results = benchmark_strategies(files)
+
+        print(f'\n Read {total_bytes / 1000000:.1f} MB per pass:')
+        for label, throughput in results:
+            print(f' - {label}: {throughput:.1f} MB/s')
+
+    else:
+        print('\n Folder path is invalid. Exiting...')
+        sys.exit(1)
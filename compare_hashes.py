@@ -1,131 +1,1186 @@
-import os.path
-import sys
-import hashlib
-import csv
-import datetime
-
-
-# Define key functions that will be executed in this script.
-
-# Locate the directory that the safe_copy.py is located in.
-def get_script_directory():
-    print('\n Locating script directory...')
-    return os.path.dirname(os.path.realpath((sys.argv[0])))
-
-# Ensure a path exists.
-def check_path_exists(path: str):
-    print('\n Checking for existence of "' + path + "'...")
-    return os.path.exists(path)
-
-# Obtain list of all files within folder.
-def list_all_files(folder_path):
-    all_files = []
-    for root, _, files in os.walk(folder_path):
-        for f in files:
-            all_files.append(os.path.join(root, f))
-    return all_files
-
-# Generate MD5 hashes for folder contents.
-def generate_md5(file_path):
-    hasher = hashlib.md5()
-    with open(file_path, 'rb') as f:
-        chunk = f.read(4096)
-        while len(chunk) > 0:
-            hasher.update(chunk)
-            chunk = f.read(4096)
-    return hasher.hexdigest()
-
-# Ensure there are no spaces or issue characters in filename for CSV log file.
-def no_space_name(path):
-    return os.path.basename(os.path.normpath(path)).replace(" ", "_")
-
-# Write filepaths and generated file hashes to individual CSV files.
-def write_hashes_to_csv(file_list, base_folder, csv_path):
-    with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['Relative_Path', 'MD5_Hash'])
-
-        for file_path in file_list:
-            relative_path = os.path.relpath(file_path, base_folder)
-            file_hash = generate_md5(file_path)
-            writer.writerow([relative_path, file_hash])
-
-# Compare the logs to identify discrepancies in the file directories.
-def compare_hash_csvs(csv1, csv2):
-    def load_csv(path):
-        with open(path, 'r', encoding='utf-8') as f:
-            return {rows[0]: rows[1] for rows in csv.reader(f) if rows and rows[0] != 'Relative_Path'}
-
-    hash1 = load_csv(csv1)
-    hash2 = load_csv(csv2)
-
-    all_keys = set(hash1.keys()).union(set(hash2.keys()))
-    evaluation = []
-
-    for key in sorted(all_keys):
-        value1 = hash1.get(key)
-        value2 = hash2.get(key)
-
-        if value1 is None:
-            status = f'Unique - Only in {no_space_name(folder_2)}'
-        elif value2 is None:
-            status = f'Unique - Only in {no_space_name(folder_1)}'
-       # elif value1 != value2:
-       #     status = 'Hash mismatch'
-        else:
-            status = 'Duplicate - Present in both folders'
-
-        evaluation.append((key, value1 or '', value2 or '', status))
-
-    return evaluation
-
-# Write results from hash comparison to a new CSV log.
-def write_hash_comparison_to_csv(hash_evaluation, output_path):
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['Relative_Path', 'Folder1_MD5', 'Folder2_MD5', 'Status'])
-        for evaluation in hash_evaluation:
-            writer.writerow(evaluation)
-
-###############################################
-# Execution of functions using user-specified paths occurs below, provided the user supplies valid paths.
-
-# Get user variables (folder names).
-folder_1 = input('Enter first folder file path for analysis: ').strip()
-folder_2 = input('Enter second folder file path for analysis: ').strip()
-
-if check_path_exists(folder_1) and check_path_exists(folder_2):
-    print('\nBoth folders exist, proceeding with checksum generation...')
-
-    # Set up file list variables.
-    files_1 = list_all_files(folder_1)
-    files_2 = list_all_files(folder_2)
-
-    # Set up CSV filenames to write to.
-    script_dir = get_script_directory()
-    logs_dir = os.path.join(script_dir, "compare_logs")
-    os.makedirs(logs_dir, exist_ok=True)
-    today_date = datetime.date.today().strftime("%d-%m-%Y")
-    csv1_path = os.path.join(logs_dir, f"{no_space_name(folder_1)}_hashes_{today_date}.csv")
-    csv2_path = os.path.join(logs_dir, f"{no_space_name(folder_2)}_hashes_{today_date}.csv")
-    report_path = os.path.join(logs_dir, f"comparison_report_{no_space_name(folder_1)}_vs_{no_space_name(folder_2)}_{today_date}.csv")
-
-    # Run function to write hashes for user input into CSV files.
-    print('\n Creating CSV logs with MD5 checksums for every file in each folder...')
-    write_hashes_to_csv(files_1, folder_1, csv1_path)
-    write_hashes_to_csv(files_2, folder_2, csv2_path)
-
-    # Set up variables to establishes discrepancies.
-    evaluation = compare_hash_csvs(csv1_path, csv2_path)
-
-    # Deploy function to write reports for any discrepancies identified.
-    print(f'\n Writing full comparison report to {report_path}...')
-    write_hash_comparison_to_csv(evaluation, report_path)
-
-    for diff in evaluation:
-        rel_path, hash1, hash2, status = diff
-        print(f'- {rel_path} | {status}')
-
-else:
-    print('\n One or both folder paths are invalid. Exiting...')
-    sys.exit(1)
+import os.path
+import sys
+import hashlib
+import csv
+import datetime
+import threading
+import time
+import sqlite3
+import mmap
+import heapq
+import tempfile
+from collections import deque, namedtuple, Counter
+from array import array
+from bisect import bisect_left
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+# Settings for checksum generation: the type of worker pool used to hash files ('thread' or 'process') and the maximum number of workers hashing files on any one storage device.
+HASH_POOL = 'thread'
+HASH_WORKERS_PER_DEVICE = 4
+
+# Settings for fixity: the hashlib algorithms generated from every read of a file, each logged in its own CSV column. MD5 must stay in the list, as duplicate reports group files by it; add 'blake2b' (or any other hashlib algorithm) for stronger fixity at the cost of CPU rather than disk reads.
+HASH_ALGORITHMS = ['md5', 'sha256']
+
+# Settings for reading files: the size of the buffer each worker reuses for every read, and how files are read for hashing ('read' allocates a new chunk for every read, 'readinto' fills the reusable buffer, 'mmap' maps the file into memory and is best kept for local disks). Run benchmark_hashing.py to compare the strategies on your own storage.
+HASH_BUFFER_SIZE = 1024 * 1024
+HASH_READ_STRATEGY = 'readinto'
+
+# Settings for the operating system's page cache: whether files are dropped from the cache once they have been read, so that hashing large folders does not push out the files other work on the same server is using. Off by default.
+DROP_CACHE_AFTER_READ = False
+
+# Settings for the persistent hash cache: its location (by default the folder holding compare_hashes.py and safe_copy.py, next to their logs folders, so that compare_hashes.py, safe_copy.py and structure_SIPs.py all share one cache; set the HASH_CACHE_FILE environment variable to keep it elsewhere), the size in megabytes beyond which the least recently used files are forgotten, and how often (in files hashed or reused, or in seconds) its changes are committed.
+HASH_CACHE_FILE = os.environ.get('HASH_CACHE_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hash_cache.sqlite'))
+HASH_CACHE_MAX_MB = 1024
+HASH_CACHE_COMMIT_FILES = 1000
+HASH_CACHE_COMMIT_SECONDS = 1.0
+
+# Settings for the manifest store: its location (by default the folder holding compare_hashes.py and safe_copy.py, next to the hash cache, so that compare_hashes.py, safe_copy.py and structure_SIPs.py all share one store; set the MANIFEST_STORE_FILE environment variable to keep it elsewhere) and whether every comparison report is also recorded in it, as a table indexed on relative path, checksum and mismatches, so runs can be queried without reading their CSV logs.
+MANIFEST_STORE_FILE = os.environ.get('MANIFEST_STORE_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manifest_store.sqlite'))
+RECORD_RUNS = True
+
+# Settings for content-dedup mode: the number of bytes read from the start and from the end of a file to tell apart files of the same size before generating full hashes.
+PARTIAL_HASH_BYTES = 65536
+
+# Settings for comparing hash CSVs too large to hold in memory ('--external-sort'): the number of rows sorted in memory at a time, and the folder for the temporary files holding sorted rows (by default the system's temporary folder), which needs roughly four times the space of both hash CSVs.
+SORT_RUN_ROWS = 200000
+SORT_TEMP_FOLDER = ''
+
+# Settings for progress: the minimum number of seconds between progress updates, which keeps printing them from slowing down runs of many small files.
+PROGRESS_INTERVAL = 5.0
+
+# Settings for walking folders: the maximum number of files found by a background walk that may be waiting to be hashed or copied.
+WALK_QUEUE_SIZE = 100000
+
+
+# Define key functions that will be executed in this script.
+
+# Locate the directory that the safe_copy.py is located in.
+def get_script_directory():
+    print('\n Locating script directory...')
+    return os.path.dirname(os.path.realpath((sys.argv[0])))
+
+# Ensure a path exists.
+def check_path_exists(path: str):
+    print('\n Checking for existence of "' + path + "'...")
+    return os.path.exists(path)
+
+# A file found while walking a folder: its full and relative paths and the stat signature needed to hash, cache and copy it. The stat fields keep their os.stat names, so an entry can be used wherever a stat result is.
+FileEntry = namedtuple('FileEntry', ['path', 'relative_path', 'st_size', 'st_mtime_ns', 'st_ino', 'st_dev'])
+
+# Walk a folder with os.scandir, yielding an entry for every file as soon as it is found, in the same order as os.walk. Each file is only stat'ed once, and every file found is added to the progress totals.
+def walk_files(folder_path):
+    folders = [(folder_path, '')]
+    start_progress_scan()
+    try:
+        while folders:
+            subfolders = []
+            current_folder, relative_folder = folders.pop()
+            with os.scandir(current_folder) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        # Like os.walk, do not descend into symbolic links to folders.
+                        if not entry.is_symlink():
+                            subfolders.append((entry.path, relative_folder + entry.name + os.sep))
+                        continue
+                    # On Windows, os.scandir does not fill in the device and inode used by the hash cache.
+                    file_stat = os.stat(entry.path) if os.name == 'nt' else entry.stat()
+                    add_to_progress_total(file_stat.st_size)
+                    yield FileEntry(entry.path, relative_folder + entry.name, file_stat.st_size,
+                                    file_stat.st_mtime_ns, file_stat.st_ino, file_stat.st_dev)
+            folders.extend(reversed(subfolders))
+    finally:
+        finish_progress_scan()
+
+# Walk a folder in a background thread, yielding its entries as they are found so that hashing or copying can start before the walk is finished. The walk only runs up to WALK_QUEUE_SIZE files ahead.
+def walk_files_in_background(folder_path):
+    found = queue.Queue(maxsize=WALK_QUEUE_SIZE)
+    walk_finished = object()
+
+    def walk():
+        try:
+            for entry in walk_files(folder_path):
+                found.put(entry)
+            found.put(walk_finished)
+        except Exception as error:
+            found.put(error)
+
+    threading.Thread(target=walk, daemon=True).start()
+    while True:
+        entry = found.get()
+        if entry is walk_finished:
+            return
+        if isinstance(entry, Exception):
+            raise entry
+        yield entry
+
+# Progress of the current run against the totals found so far by walking the source folders, updated from every thread.
+progress = {}
+progress_lock = threading.Lock()
+
+# Start reporting progress of a task (e.g. 'Copying'). Totals already known can be given; otherwise they are added up as folders are walked.
+def start_progress(task, total_files=0, total_bytes=0):
+    now = time.monotonic()
+    with progress_lock:
+        progress.update(task=task, total_files=total_files, total_bytes=total_bytes, files=0, bytes=0, scans=0,
+                        start=now, last_update=now, last_bytes=0)
+    print(f'\n {task} files...')
+
+# Record that a folder walk has started, so progress reports totals as incomplete until it finishes.
+def start_progress_scan():
+    with progress_lock:
+        if progress:
+            progress['scans'] += 1
+
+# Add a file found by a folder walk to the progress totals.
+def add_to_progress_total(file_bytes):
+    with progress_lock:
+        if progress:
+            progress['total_files'] += 1
+            progress['total_bytes'] += file_bytes
+
+# Record that a folder walk has finished, announcing the totals once every walk has.
+def finish_progress_scan():
+    with progress_lock:
+        if progress and progress['scans'] > 0:
+            progress['scans'] -= 1
+            if progress['scans'] == 0:
+                print(f" Found {progress['total_files']} files ({progress['total_bytes'] / 1000000:.1f} MB).", flush=True)
+
+# Print a progress update: files and bytes done, the MB/s since the last update and the estimated time remaining at the average rate so far. Until the folders have been walked, the totals are those found so far and no estimate is given. Updates are printed on a single line when running in a terminal.
+def print_progress(now, final=False):
+    elapsed = now - progress['start']
+    rate = (progress['bytes'] - progress['last_bytes']) / 1000000 / max(now - progress['last_update'], 1e-9)
+    if final:
+        rate = progress['bytes'] / 1000000 / max(elapsed, 1e-9)
+    if progress['bytes'] and progress['total_bytes']:
+        remaining = elapsed * (progress['total_bytes'] - progress['bytes']) / progress['bytes']
+    elif progress['files']:
+        remaining = elapsed * (progress['total_files'] - progress['files']) / progress['files']
+    else:
+        remaining = 0
+    if final:
+        status = f'done in {datetime.timedelta(seconds=round(elapsed))}'
+    elif progress['scans']:
+        status = 'still walking folders'
+    else:
+        status = f'ETA {datetime.timedelta(seconds=round(max(remaining, 0)))}'
+    line = (f" {progress['task']}: {progress['files']}/{progress['total_files']} files, "
+            f"{progress['bytes'] / 1000000:.1f}/{progress['total_bytes'] / 1000000:.1f} MB, {rate:.1f} MB/s, {status}")
+    if sys.stdout.isatty():
+        print('\r' + line.ljust(100), end='\n' if final else '', flush=True)
+    else:
+        print(line, flush=True)
+
+# Record a file as done, printing a progress update if at least PROGRESS_INTERVAL seconds have passed since the last one. Does nothing if progress is not being reported.
+def update_progress(file_bytes):
+    with progress_lock:
+        if not progress:
+            return
+        progress['files'] += 1
+        progress['bytes'] += file_bytes
+        now = time.monotonic()
+        if now - progress['last_update'] >= PROGRESS_INTERVAL:
+            print_progress(now)
+            progress['last_update'] = now
+            progress['last_bytes'] = progress['bytes']
+
+# Print a final progress update and stop reporting progress.
+def finish_progress():
+    with progress_lock:
+        if progress:
+            print_progress(time.monotonic(), final=True)
+            progress.clear()
+
+# Buffers for reading files, one per worker thread so each worker allocates its buffer once and reuses it for every file it reads.
+read_buffers = threading.local()
+
+# Return the calling thread's reusable read buffer as a memoryview of HASH_BUFFER_SIZE bytes.
+def get_read_buffer():
+    buffer = getattr(read_buffers, 'buffer', None)
+    if buffer is None or len(buffer) != HASH_BUFFER_SIZE:
+        buffer = memoryview(bytearray(HASH_BUFFER_SIZE))
+        read_buffers.buffer = buffer
+    return buffer
+
+# Read an open file from its current position in chunks of up to HASH_BUFFER_SIZE bytes using the given strategy ('read', 'readinto' or 'mmap'), yielding each chunk. Chunks yielded by 'readinto' and 'mmap' are views that are only valid until the next chunk is read, so they must be used straight away.
+def read_chunks(f, strategy=None):
+    strategy = strategy or HASH_READ_STRATEGY
+    if strategy == 'mmap':
+        # Empty files cannot be mapped, and there is nothing to read from them.
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # Every view of the mapping must be released before it can be closed.
+            with memoryview(mapped) as view:
+                for offset in range(f.tell(), len(mapped), HASH_BUFFER_SIZE):
+                    with view[offset:offset + HASH_BUFFER_SIZE] as chunk:
+                        yield chunk
+    elif strategy == 'readinto':
+        buffer = get_read_buffer()
+        size = f.readinto(buffer)
+        while size:
+            yield buffer[:size]
+            size = f.readinto(buffer)
+    else:
+        chunk = f.read(HASH_BUFFER_SIZE)
+        while len(chunk) > 0:
+            yield chunk
+            chunk = f.read(HASH_BUFFER_SIZE)
+
+# Advise the operating system that an open file's pages are no longer needed, so they are dropped from the page cache (pages written but not yet on disk are kept until they are). Does nothing where this is not supported.
+def drop_from_cache(fd):
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+# Generate hashes for folder contents with every algorithm in HASH_ALGORITHMS, feeding each chunk read to all of them so the file is only read once. The file is dropped from the page cache afterwards if DROP_CACHE_AFTER_READ is set. Returns a dictionary of hex digests keyed by algorithm.
+def generate_hashes(file_path, strategy=None):
+    hashers = {algorithm: hashlib.new(algorithm) for algorithm in HASH_ALGORITHMS}
+    with open(file_path, 'rb', buffering=0) as f:
+        for chunk in read_chunks(f, strategy):
+            for hasher in hashers.values():
+                hasher.update(chunk)
+        if DROP_CACHE_AFTER_READ:
+            drop_from_cache(f.fileno())
+    return {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+
+# Return the CSV column label used for an algorithm's hashes (e.g. 'MD5', 'SHA256').
+def hash_label(algorithm):
+    return algorithm.upper()
+
+# Worker pools for checksum generation, one per storage device so that folders on different volumes are hashed at the same time without overloading any one disk.
+hash_pools = {}
+hash_pools_lock = threading.Lock()
+
+# Return the worker pool for a storage device, creating it on first use.
+def get_hash_pool(device):
+    with hash_pools_lock:
+        if device not in hash_pools:
+            pool_type = ProcessPoolExecutor if HASH_POOL == 'process' else ThreadPoolExecutor
+            hash_pools[device] = pool_type(max_workers=HASH_WORKERS_PER_DEVICE)
+        return hash_pools[device]
+
+# Persistent hash cache shared between runs, keyed on each file's device and inode and only reused while the file's size and modification time are unchanged. Reused entries are only marked as used, and new entries only committed, every HASH_CACHE_COMMIT_FILES files or HASH_CACHE_COMMIT_SECONDS seconds, so that looking up cached hashes never holds the cache's write lock and other runs sharing the cache are never kept waiting for long.
+hash_cache = None
+hash_cache_lock = threading.Lock()
+hash_cache_used = []
+hash_cache_stored = 0
+hash_cache_committed = 0.0
+
+# Open (creating if necessary) the hash cache at HASH_CACHE_FILE.
+def open_hash_cache():
+    global hash_cache, hash_cache_stored, hash_cache_committed
+    hash_cache = sqlite3.connect(HASH_CACHE_FILE, timeout=60, check_same_thread=False)
+    hash_cache_used.clear()
+    hash_cache_stored = 0
+    hash_cache_committed = time.time()
+    hash_cache.execute('PRAGMA journal_mode=WAL')
+    hash_cache.execute('CREATE TABLE IF NOT EXISTS file_hashes (device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, '
+                       'digests TEXT, path TEXT, last_used REAL, PRIMARY KEY (device, inode))')
+    hash_cache.execute('CREATE INDEX IF NOT EXISTS file_hashes_last_used ON file_hashes (last_used)')
+    hash_cache.execute('CREATE INDEX IF NOT EXISTS file_hashes_path ON file_hashes (path)')
+
+# Return the cached hashes for a file if its stat signature is unchanged since it was hashed and every algorithm in HASH_ALGORITHMS was generated, otherwise None.
+def lookup_cached_hashes(file_stat):
+    if hash_cache is None:
+        return None
+    key = (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+    with hash_cache_lock:
+        row = hash_cache.execute('SELECT digests FROM file_hashes WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?', key).fetchone()
+        if not row:
+            return None
+        digests = dict(item.split('=') for item in row[0].split(';'))
+        if not all(algorithm in digests for algorithm in HASH_ALGORITHMS):
+            return None
+        hash_cache_used.append((time.time(), file_stat.st_dev, file_stat.st_ino))
+        commit_hash_cache()
+    return {algorithm: digests[algorithm] for algorithm in HASH_ALGORITHMS}
+
+# Record the hashes generated for a file against the stat signature it had when it was read, committing regularly so an interrupted run keeps most of its work.
+def store_cached_hashes(file_path, file_stat, hashes):
+    global hash_cache_stored
+    if hash_cache is None:
+        return
+    digests = ';'.join(f'{algorithm}={digest}' for algorithm, digest in hashes.items())
+    with hash_cache_lock:
+        hash_cache.execute('INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns,
+                            digests, os.path.abspath(file_path), time.time()))
+        hash_cache_stored += 1
+        commit_hash_cache()
+
+# Mark the cached entries reused since the last commit as used and commit them with any new entries, once HASH_CACHE_COMMIT_FILES files have been hashed or reused or HASH_CACHE_COMMIT_SECONDS seconds have passed (or straight away if forced). Must be called holding hash_cache_lock.
+def commit_hash_cache(force=False):
+    global hash_cache_stored, hash_cache_committed
+    now = time.time()
+    if not force and len(hash_cache_used) + hash_cache_stored < HASH_CACHE_COMMIT_FILES and now - hash_cache_committed < HASH_CACHE_COMMIT_SECONDS:
+        return
+    hash_cache.executemany('UPDATE file_hashes SET last_used = ? WHERE device = ? AND inode = ?', hash_cache_used)
+    hash_cache.commit()
+    hash_cache_used.clear()
+    hash_cache_stored = 0
+    hash_cache_committed = now
+
+# Close the hash cache, evicting the least recently used entries while it holds more than HASH_CACHE_MAX_MB megabytes. Entries are all much the same size, so the number kept is estimated from the average size of an entry.
+def close_hash_cache():
+    global hash_cache
+    if hash_cache is None:
+        return
+    with hash_cache_lock:
+        commit_hash_cache(force=True)
+        page_size = hash_cache.execute('PRAGMA page_size').fetchone()[0]
+        used_pages = hash_cache.execute('PRAGMA page_count').fetchone()[0] - hash_cache.execute('PRAGMA freelist_count').fetchone()[0]
+        used_bytes = used_pages * page_size
+        if used_bytes > HASH_CACHE_MAX_MB * 1000000:
+            entries = hash_cache.execute('SELECT COUNT(*) FROM file_hashes').fetchone()[0]
+            hash_cache.execute('DELETE FROM file_hashes WHERE rowid IN '
+                               '(SELECT rowid FROM file_hashes ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                               (int(entries * HASH_CACHE_MAX_MB * 1000000 / used_bytes),))
+        hash_cache.commit()
+        hash_cache.close()
+        hash_cache = None
+
+# Remove cached hashes for a file or every file under a folder, or the entire cache if no path is given, returning the number of entries removed.
+def invalidate_hash_cache(folder_path=None):
+    with hash_cache_lock:
+        if folder_path:
+            prefix = os.path.join(os.path.abspath(folder_path), '')
+            removed = hash_cache.execute('DELETE FROM file_hashes WHERE path = ? OR substr(path, 1, ?) = ?',
+                                         (os.path.abspath(folder_path), len(prefix), prefix)).rowcount
+        else:
+            removed = hash_cache.execute('DELETE FROM file_hashes').rowcount
+        hash_cache.commit()
+    return removed
+
+# Handle the '--clear-hash-cache [path]' command, which invalidates cached hashes and exits without running the programme.
+def run_clear_hash_cache_command():
+    if '--clear-hash-cache' not in sys.argv:
+        return
+    arguments = sys.argv[sys.argv.index('--clear-hash-cache') + 1:]
+    open_hash_cache()
+    removed = invalidate_hash_cache(arguments[0] if arguments else None)
+    close_hash_cache()
+    print(f'\n Removed {removed} cached hashes.')
+    sys.exit(0)
+
+# Manifest store shared between runs: a 'runs' table describing every log recorded and, for each run, a table of its log's rows (named 'run_' and its number) with the log's columns and a flag marking mismatches. Rows are inserted in batches of STORE_BATCH_ROWS.
+manifest_store = None
+manifest_store_lock = threading.Lock()
+store_run = None
+store_run_columns = []
+store_run_batch = []
+store_run_rows = 0
+STORE_BATCH_ROWS = 1000
+
+# Open (creating if necessary) the manifest store at MANIFEST_STORE_FILE.
+def open_manifest_store():
+    global manifest_store
+    manifest_store = sqlite3.connect(MANIFEST_STORE_FILE, timeout=60, check_same_thread=False)
+    manifest_store.execute('PRAGMA journal_mode=WAL')
+    manifest_store.execute('CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY, programme TEXT, log_name TEXT, started REAL, '
+                           'columns TEXT, path_column TEXT, digest_columns TEXT, rows INTEGER)')
+    manifest_store.execute('CREATE INDEX IF NOT EXISTS runs_started ON runs (started)')
+
+# Quote a CSV column label for use as a column name in SQL.
+def quote_column(label):
+    return '"' + label.replace('"', '""') + '"'
+
+# Start recording the rows of a CSV log in the manifest store as a new run, creating its table with the log's columns. Does nothing if the store is not open.
+def start_store_run(log_path, columns, path_column, digest_columns):
+    global store_run, store_run_columns, store_run_rows
+    if manifest_store is None:
+        return
+    with manifest_store_lock:
+        store_run = manifest_store.execute('INSERT INTO runs (programme, log_name, started, columns, path_column, digest_columns, rows) '
+                                           'VALUES (?, ?, ?, ?, ?, ?, 0)',
+                                           (os.path.basename(sys.argv[0]), os.path.basename(log_path), time.time(),
+                                            '\n'.join(columns), path_column, '\n'.join(digest_columns))).lastrowid
+        store_run_columns = list(columns)
+        store_run_batch.clear()
+        store_run_rows = 0
+        manifest_store.execute(f'CREATE TABLE run_{store_run} ('
+                               + ', '.join(f'{quote_column(label)} TEXT' for label in columns) + ', mismatch INTEGER)')
+        manifest_store.commit()
+
+# Insert the batch of rows waiting to be recorded in the manifest store and commit them, so an interrupted run keeps most of its rows.
+def flush_store_batch():
+    global store_run_rows
+    manifest_store.executemany(f'INSERT INTO run_{store_run} VALUES ({", ".join("?" * (len(store_run_columns) + 1))})', store_run_batch)
+    store_run_rows += len(store_run_batch)
+    store_run_batch.clear()
+    manifest_store.commit()
+
+# Record a row of the CSV log being written (a dictionary keyed by column) in the manifest store. Does nothing if no run is being recorded.
+def store_row(row, mismatch):
+    if store_run is None:
+        return
+    with manifest_store_lock:
+        store_run_batch.append([row.get(label, '') for label in store_run_columns] + [int(mismatch)])
+        if len(store_run_batch) >= STORE_BATCH_ROWS:
+            flush_store_batch()
+
+# Finish recording the current run in the manifest store, noting how many rows it holds and indexing it on its relative path, on its checksums of the first algorithm in HASH_ALGORITHMS and on whether each row is a mismatch. Indexes are built once every row has been inserted, which is much quicker than keeping them up to date row by row.
+def finish_store_run():
+    global store_run
+    if store_run is None:
+        return
+    with manifest_store_lock:
+        flush_store_batch()
+        path_column, digest_columns = manifest_store.execute('SELECT path_column, digest_columns FROM runs WHERE run = ?', (store_run,)).fetchone()
+        for index, label in enumerate([path_column] + digest_columns.split('\n') + ['mismatch']):
+            manifest_store.execute(f'CREATE INDEX run_{store_run}_{index} ON run_{store_run} ({quote_column(label)})')
+        manifest_store.execute('UPDATE runs SET rows = ? WHERE run = ?', (store_run_rows, store_run))
+        manifest_store.commit()
+        store_run = None
+
+# Close the manifest store.
+def close_manifest_store():
+    global manifest_store
+    if manifest_store is None:
+        return
+    finish_store_run()
+    with manifest_store_lock:
+        manifest_store.close()
+        manifest_store = None
+
+# Return the runs recorded in the manifest store since a time (in seconds since the epoch), oldest first, as dictionaries of their details.
+def get_store_runs(since=0):
+    labels = ['run', 'programme', 'log_name', 'started', 'columns', 'path_column', 'digest_columns', 'rows']
+    rows = manifest_store.execute(f'SELECT {", ".join(labels)} FROM runs WHERE started >= ? ORDER BY run', (since,)).fetchall()
+    return [dict(zip(labels, row)) for row in rows]
+
+# Find every row of every run holding a checksum, yielding the run, the row's relative path and the column holding the checksum. Only the checksums of the first algorithm in HASH_ALGORITHMS are indexed, so each run is searched with one indexed query per checksum column.
+def find_digest_in_store(digest):
+    for run in get_store_runs():
+        for label in run['digest_columns'].split('\n'):
+            query = f'SELECT {quote_column(run["path_column"])} FROM run_{run["run"]} WHERE {quote_column(label)} = ?'
+            for (relative_path,) in manifest_store.execute(query, (digest.strip().lower(),)):
+                yield run, relative_path, label
+
+# Find every mismatch recorded by the runs started since a time (in seconds since the epoch), yielding the run and the row as a dictionary keyed by column.
+def find_mismatches_in_store(since):
+    for run in get_store_runs(since):
+        columns = run['columns'].split('\n')
+        query = f'SELECT {", ".join(quote_column(label) for label in columns)} FROM run_{run["run"]} WHERE mismatch = 1'
+        for row in manifest_store.execute(query):
+            yield run, dict(zip(columns, row))
+
+# Export the rows of a run to a CSV log with the same columns as the log it was recorded from, returning the number of rows written, or None if there is no such run.
+def export_store_run(run_number, output_path):
+    run = manifest_store.execute('SELECT columns FROM runs WHERE run = ?', (run_number,)).fetchone()
+    if run is None:
+        return None
+    columns = run[0].split('\n')
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        exported = 0
+        for row in manifest_store.execute(f'SELECT {", ".join(quote_column(label) for label in columns)} FROM run_{run_number} ORDER BY rowid'):
+            writer.writerow(row)
+            exported += 1
+    return exported
+
+# Usage of each manifest store command, printed if it is given a missing or invalid value.
+manifest_store_usage = {
+    '--list-runs': '--list-runs',
+    '--find-digest': '--find-digest <checksum>',
+    '--mismatches-since': '--mismatches-since <dd-mm-yyyy>',
+    '--export-run': '--export-run <run number> [output CSV path]'
+}
+
+# Return whether the values given to a manifest store command are valid: a checksum, a date as dd-mm-yyyy or a run number.
+def valid_store_arguments(command, arguments):
+    if command == '--list-runs':
+        return True
+    if not arguments:
+        return False
+    try:
+        if command == '--mismatches-since':
+            datetime.datetime.strptime(arguments[0], "%d-%m-%Y")
+        elif command == '--export-run':
+            int(arguments[0])
+    except ValueError:
+        return False
+    return True
+
+# Handle the manifest store commands, which query or export the runs recorded in the store and exit without running the programme: '--list-runs', '--find-digest <checksum>', '--mismatches-since <dd-mm-yyyy>' and '--export-run <run> [CSV path]'. A command given a missing or invalid value exits with its usage before the store is opened.
+def run_manifest_store_command():
+    command = next((command for command in manifest_store_usage if command in sys.argv), None)
+    if command is None:
+        return
+    arguments = sys.argv[sys.argv.index(command) + 1:]
+    if not valid_store_arguments(command, arguments):
+        sys.exit(f'\n Usage: python {os.path.basename(sys.argv[0])} {manifest_store_usage[command]}')
+    open_manifest_store()
+    try:
+        if command == '--list-runs':
+            for run in get_store_runs():
+                started = datetime.datetime.fromtimestamp(run['started']).strftime("%d-%m-%Y %H:%M:%S")
+                print(f" Run {run['run']} | {run['programme']} | {started} | {run['rows']} rows | {run['log_name']}")
+        elif command == '--find-digest':
+            for run, relative_path, label in find_digest_in_store(arguments[0]):
+                print(f" Run {run['run']} | {run['log_name']} | {label} | {relative_path}")
+        elif command == '--mismatches-since':
+            since = datetime.datetime.strptime(arguments[0], "%d-%m-%Y").timestamp()
+            for run, row in find_mismatches_in_store(since):
+                print(f" Run {run['run']} | {run['log_name']} | {row[run['path_column']]} | {row.get('Status', '')}")
+        else:
+            output_path = arguments[1] if len(arguments) > 1 else f'run_{arguments[0]}.csv'
+            exported = export_store_run(int(arguments[0]), output_path)
+            if exported is None:
+                sys.exit(f'\n There is no run {arguments[0]} in the manifest store.')
+            print(f'\n Exported {exported} rows of run {arguments[0]} to {output_path}.')
+    finally:
+        close_manifest_store()
+    sys.exit(0)
+
+# Return an already-completed future holding a value, so cached hashes can sit in the same queues as hashes still being generated.
+def completed_future(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+# Shut down all worker pools once checksum generation is complete.
+def shutdown_hash_pools():
+    with hash_pools_lock:
+        for pool in hash_pools.values():
+            pool.shutdown()
+        hash_pools.clear()
+
+# Generate hashes for file entries (from walk_files) using the worker pools, yielding each entry with its hashes in the original order. Files unchanged since they were last hashed reuse their cached hashes, and only a limited number of files are queued at once to keep memory use flat on large folders.
+def generate_hashes_in_order(entries):
+    pending = deque()
+
+    def next_result():
+        queued_entry, future = pending.popleft()
+        file_hashes = future.result()
+        store_cached_hashes(queued_entry.path, queued_entry, file_hashes)
+        update_progress(queued_entry.st_size)
+        return queued_entry, file_hashes
+
+    for entry in entries:
+        cached_hashes = lookup_cached_hashes(entry)
+        if cached_hashes:
+            future = completed_future(cached_hashes)
+        else:
+            future = get_hash_pool(entry.st_dev).submit(generate_hashes, entry.path)
+        pending.append((entry, future))
+        if len(pending) >= HASH_WORKERS_PER_DEVICE * 4:
+            yield next_result()
+    while pending:
+        yield next_result()
+
+# Ensure there are no spaces or issue characters in filename for CSV log file.
+def no_space_name(path):
+    return os.path.basename(os.path.normpath(path)).replace(" ", "_")
+
+# Write relative filepaths and generated file hashes (one column per algorithm) for file entries (from walk_files) to individual CSV files.
+def write_hashes_to_csv(entries, csv_path):
+    with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Relative_Path'] + [f'{hash_label(algorithm)}_Hash' for algorithm in HASH_ALGORITHMS])
+
+        for entry, file_hashes in generate_hashes_in_order(entries):
+            writer.writerow([entry.relative_path] + [file_hashes[algorithm] for algorithm in HASH_ALGORITHMS])
+
+# Write the hash CSV files for both folders at the same time, since they usually sit on different volumes. Each folder is walked in the background, so hashing starts as soon as its first files are found. An error in either folder is raised once both have stopped.
+def write_both_hashes_to_csv(folder_1, csv1_path, folder_2, csv2_path):
+    second_folder_pool = ThreadPoolExecutor(max_workers=1)
+    second_folder = second_folder_pool.submit(write_hashes_to_csv, walk_files_in_background(folder_2), csv2_path)
+    try:
+        write_hashes_to_csv(walk_files_in_background(folder_1), csv1_path)
+        # Raise any error hit while writing the second folder's log, so that a log cut short is never compared.
+        second_folder.result()
+    finally:
+        second_folder_pool.shutdown()
+        shutdown_hash_pools()
+        finish_progress()
+
+# Split a path into its folder (ending in a separator, or '' if there is none) and file name, like os.path.split but keeping the separator so that joining them back is a concatenation.
+def split_folder(path):
+    split = path.rfind(os.sep) + 1
+    if os.altsep:
+        split = max(split, path.rfind(os.altsep) + 1)
+    return path[:split], path[split:]
+
+# A manifest of files and their hashes held compactly in memory, so that folders of millions of files can be compared without a dictionary of hex strings for every file. Rows are kept in columns: relative paths as a folder, interned so that it is held once however many files it holds, and a file name, and hashes packed as binary digests (16 bytes for MD5 rather than a 32-character string) into a single bytearray. Hashes that cannot be packed, such as blank or malformed CSV columns, are kept as text instead. Call sort() once every row has been added, so rows can be looked up by relative path, and sort_by_content() to look them up by content too.
+class Manifest:
+    __slots__ = ('folders', 'folder_index', 'folder_ids', 'names', 'digests', 'text_digests', 'digest_sizes', 'hex_lengths',
+                 'row_size', 'path_order', 'content_order')
+
+    def __init__(self):
+        self.folders = []
+        self.folder_index = {}
+        self.folder_ids = array('L')
+        self.names = []
+        self.digests = bytearray()
+        self.text_digests = {}
+        self.digest_sizes = [hashlib.new(algorithm).digest_size for algorithm in HASH_ALGORITHMS]
+        self.hex_lengths = [size * 2 for size in self.digest_sizes]
+        self.row_size = sum(self.digest_sizes)
+        self.path_order = array('L')
+        self.content_order = array('L')
+
+    def __len__(self):
+        return len(self.names)
+
+    # Add a file from its relative path and hex digests (in HASH_ALGORITHMS order), returning its row number.
+    def add(self, relative_path, hex_digests):
+        row = len(self.names)
+        folder, name = split_folder(relative_path)
+        self.folder_ids.append(self.intern_folder(folder))
+        self.names.append(name)
+        text = ''.join(hex_digests)
+        try:
+            packed = bytes.fromhex(text)
+        except ValueError:
+            packed = b''
+        # Only pack digests of the expected lengths that unpack to exactly the same text.
+        if packed.hex() != text or list(map(len, hex_digests)) != self.hex_lengths:
+            self.text_digests[row] = tuple(hex_digests)
+            packed = bytes(self.row_size)
+        self.digests += packed
+        return row
+
+    # Return the number of a folder, adding it if it is new.
+    def intern_folder(self, folder):
+        folder_id = self.folder_index.get(folder)
+        if folder_id is None:
+            folder_id = self.folder_index[folder] = len(self.folders)
+            self.folders.append(folder)
+        return folder_id
+
+    # Return the relative path of a row.
+    def path(self, row):
+        return self.folders[self.folder_ids[row]] + self.names[row]
+
+    # Return a row's hashes as a tuple of hex digests in HASH_ALGORITHMS order.
+    def hex_digests(self, row):
+        if row in self.text_digests:
+            return self.text_digests[row]
+        start = row * self.row_size
+        hex_digests = []
+        for size in self.digest_sizes:
+            hex_digests.append(self.digests[start:start + size].hex())
+            start += size
+        return tuple(hex_digests)
+
+    # Return a key for a row's content, equal for two rows only if all of their hashes are.
+    def content_key(self, row):
+        if row in self.text_digests:
+            return b'\x01' + '\x00'.join(self.text_digests[row]).encode()
+        start = row * self.row_size
+        return b'\x00' + self.digests[start:start + self.row_size]
+
+    # Sort the rows by relative path. Where a relative path appears more than once only its last row is kept, as it would be in a dictionary. Relative paths are ordered without being rebuilt, folder by folder (see add_folder_rows).
+    def sort(self):
+        # Group the rows by folder, in order of file name within each folder (and in the order they were added for the same name), noting where each folder's rows start and end.
+        order = sorted(range(len(self.names)), key=self.names.__getitem__)
+        order.sort(key=self.folder_ids.__getitem__)
+        folder_rows = {}
+        start = 0
+        for folder_id, count in sorted(Counter(self.folder_ids).items()):
+            folder_rows[folder_id] = (start, start + count)
+            start += count
+        sorted_folders = sorted(self.folders[folder_id] for folder_id in folder_rows)
+        self.path_order = array('L')
+        self.add_folder_rows('', sorted_folders, 0, len(sorted_folders), order, folder_rows)
+        del order
+
+    # Sort the rows kept by sort() by content then relative path, so that they can also be looked up by content. Only needed by a comparison, which looks for files moved or renamed.
+    def sort_by_content(self):
+        self.content_order = array('L', sorted(self.path_order, key=self.content_key))
+
+    # Add the rows within a folder (given by its relative path, ending in a separator, or '' for the top folder) to path_order in relative path order, where sorted_folders[start:end] are the folders within it. The relative paths within a subfolder all begin with its name and a separator, so the folder's files and subfolders are sorted together, each subfolder by its name and separator, and each subfolder's rows are added where it sorts.
+    def add_folder_rows(self, folder, sorted_folders, start, end, order, folder_rows):
+        first, last = folder_rows.get(self.folder_index.get(folder), (0, 0))
+        rows = order[first:last]
+        names = list(map(self.names.__getitem__, rows))
+        # Keep only the last row of a file name added more than once.
+        if len(set(names)) < len(names):
+            rows = [row for index, row in enumerate(rows) if index + 1 == len(rows) or names[index + 1] != names[index]]
+            names = list(map(self.names.__getitem__, rows))
+        index = 0
+        if start < end and sorted_folders[start] == folder:
+            start += 1
+        while start < end:
+            # The next subfolder is named by the folders within it up to their first separator.
+            remainder = sorted_folders[start][len(folder):]
+            subfolder_name = remainder[:min(remainder.find(separator) for separator in os.sep + (os.altsep or '') if separator in remainder) + 1]
+            subfolder = folder + subfolder_name
+            subfolder_end = start
+            while subfolder_end < end and sorted_folders[subfolder_end].startswith(subfolder):
+                subfolder_end += 1
+            position = bisect_left(names, subfolder_name, index)
+            self.path_order.extend(rows[index:position])
+            index = position
+            self.add_folder_rows(subfolder, sorted_folders, start, subfolder_end, order, folder_rows)
+            start = subfolder_end
+        self.path_order.extend(rows[index:])
+
+    # Return the row of a relative path, or None if it is not in the manifest.
+    def find_path(self, relative_path):
+        low, high = 0, len(self.path_order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.path(self.path_order[middle]) < relative_path:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.path_order) and self.path(self.path_order[low]) == relative_path:
+            return self.path_order[low]
+        return None
+
+    # Return the first row (in relative path order) whose content has a given key, or None if there is none.
+    def find_content(self, key):
+        low, high = 0, len(self.content_order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.content_key(self.content_order[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.content_order) and self.content_key(self.content_order[low]) == key:
+            return self.content_order[low]
+        return None
+
+# Return the relative path of the folder holding a file listed in a hash CSV, as it is named in the folder digests ('.' for the top folder).
+def get_file_folder(relative_path):
+    return relative_path.rpartition(os.sep)[0] or '.'
+
+# Load a hash CSV written by write_hashes_to_csv into a sorted manifest, keeping only the files directly within the given folders (relative paths as named in the folder digests) if any are given.
+def load_manifest(csv_path, folders=None):
+    manifest = Manifest()
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        for rows in csv.reader(f):
+            if rows and rows[0] != 'Relative_Path' and (folders is None or get_file_folder(rows[0]) in folders):
+                manifest.add(rows[0], rows[1:])
+    manifest.sort()
+    manifest.sort_by_content()
+    return manifest
+
+# Compare the logs to identify discrepancies in the file directories, matching files on all of their hashes. Both logs are loaded into compact manifests and merged in relative path order, yielding a row for every relative path in either folder (or only for the files directly within the given folders, if any are given). Files whose relative path differs but whose content exists in the other folder are reported as moved or renamed rather than unique.
+def compare_hash_csvs(csv1, csv2, folders=None):
+    manifest1 = load_manifest(csv1, folders)
+    manifest2 = load_manifest(csv2, folders)
+    order1, order2 = manifest1.path_order, manifest2.path_order
+    index1 = index2 = 0
+    empty = ('',) * len(HASH_ALGORITHMS)
+
+    while index1 < len(order1) or index2 < len(order2):
+        row1 = order1[index1] if index1 < len(order1) else None
+        row2 = order2[index2] if index2 < len(order2) else None
+        path1 = manifest1.path(row1) if row1 is not None else None
+        path2 = manifest2.path(row2) if row2 is not None else None
+        if row2 is None or (row1 is not None and path1 < path2):
+            key, row2 = path1, None
+            index1 += 1
+        elif row1 is None or path2 < path1:
+            key, row1 = path2, None
+            index2 += 1
+        else:
+            key = path1
+            index1 += 1
+            index2 += 1
+
+        matching_row = None
+        if row1 is None:
+            matching_row = manifest1.find_content(manifest2.content_key(row2))
+            matching_path = manifest1.path(matching_row) if matching_row is not None else ''
+        elif row2 is None:
+            matching_row = manifest2.find_content(manifest1.content_key(row1))
+            matching_path = manifest2.path(matching_row) if matching_row is not None else ''
+        else:
+            matching_path = ''
+
+        if row1 is None and matching_row is not None:
+            status = f'Moved/Renamed - Content present in {no_space_name(folder_1)} under another path'
+        elif row1 is None:
+            status = f'Unique - Only in {no_space_name(folder_2)}'
+        elif row2 is None and matching_row is not None:
+            status = f'Moved/Renamed - Content present in {no_space_name(folder_2)} under another path'
+        elif row2 is None:
+            status = f'Unique - Only in {no_space_name(folder_1)}'
+        elif manifest1.content_key(row1) != manifest2.content_key(row2):
+            status = 'Modified - Hash mismatch between folders'
+        else:
+            status = 'Duplicate - Present in both folders'
+
+        value1 = manifest1.hex_digests(row1) if row1 is not None else empty
+        value2 = manifest2.hex_digests(row2) if row2 is not None else empty
+        yield (key, *value1, *value2, status, matching_path)
+
+# Write rows to a new temporary CSV file in a folder, returning its path.
+def write_temporary_rows(rows, temp_folder):
+    fd, path = tempfile.mkstemp(suffix='.csv', dir=temp_folder)
+    with open(fd, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(rows)
+    return path
+
+# Read back the rows of a temporary CSV file, deleting it once every row has been read.
+def read_temporary_rows(path):
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        yield from csv.reader(f)
+    os.remove(path)
+
+# Sort rows that may not fit in memory, yielding them in order. Rows are sorted SORT_RUN_ROWS at a time, each sorted run is written to a temporary file, and the runs are merged as they are read back. Rows that sort equally keep their original order.
+def external_sort(rows, key, temp_folder):
+    runs = []
+    run = []
+    for row in rows:
+        run.append(row)
+        if len(run) == SORT_RUN_ROWS:
+            run.sort(key=key)
+            runs.append(write_temporary_rows(run, temp_folder))
+            run = []
+    run.sort(key=key)
+    if not runs:
+        yield from run
+        return
+    runs.append(write_temporary_rows(run, temp_folder))
+    del run
+    yield from heapq.merge(*[read_temporary_rows(path) for path in runs], key=key)
+
+# Read the rows of a hash CSV sorted by relative path, without holding them all in memory, keeping only the files directly within the given folders if any are given. Where a relative path appears more than once only its last row is kept, as it is when comparing in memory.
+def read_hash_csv_by_path(csv_path, temp_folder, folders=None):
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        rows = (row for row in csv.reader(f)
+                if row and row[0] != 'Relative_Path' and (folders is None or get_file_folder(row[0]) in folders))
+        previous = None
+        for row in external_sort(rows, lambda row: row[0], temp_folder):
+            if previous is not None and row[0] != previous[0]:
+                yield previous
+            previous = row
+        if previous is not None:
+            yield previous
+
+# Find the files whose content is present in a folder under another path, without holding either in memory. Takes a temporary file of requests ([row number, *hashes]) and one of the folder's files in relative path order ([relative path, *hashes]), and yields [row number, matching path] for every request whose hashes match a file, matched to the first such file in relative path order.
+def find_moved_files(requests_path, folder_path, temp_folder):
+    requests = external_sort(read_temporary_rows(requests_path), lambda row: row[1:], temp_folder)
+    folder = external_sort(read_temporary_rows(folder_path), lambda row: (row[1:], row[0]), temp_folder)
+    file_row = next(folder, None)
+    for request in requests:
+        while file_row is not None and file_row[1:] < request[1:]:
+            file_row = next(folder, None)
+        if file_row is not None and file_row[1:] == request[1:]:
+            yield [request[0], file_row[0]]
+    # Read the rest of the folder so its temporary files are deleted.
+    for _ in folder:
+        pass
+
+# Compare the logs like compare_hash_csvs, but in bounded memory however many files they list, for folders too large to compare in memory ('--external-sort'). Both logs are sorted by relative path on disk and merged, writing each row of the comparison to a temporary file. Files only in one folder are then looked up by content in the other, with both sorted by hashes on disk, and the rows are read back and yielded in relative path order with any moved or renamed files marked. As with compare_hash_csvs, only the files directly within the given folders are compared if any are given.
+def compare_hash_csvs_external(csv1, csv2, folders=None):
+    with tempfile.TemporaryDirectory(dir=SORT_TEMP_FOLDER or None) as temp_folder:
+        paths = {name: os.path.join(temp_folder, f'{name}.csv') for name in
+                 ['comparison', 'folder_1', 'folder_2', 'requests_1', 'requests_2']}
+        files = {name: open(path, 'w', newline='', encoding='utf-8') for name, path in paths.items()}
+        writers = {name: csv.writer(f) for name, f in files.items()}
+        rows1 = read_hash_csv_by_path(csv1, temp_folder, folders)
+        rows2 = read_hash_csv_by_path(csv2, temp_folder, folders)
+        row1, row2 = next(rows1, None), next(rows2, None)
+        row_number = 0
+
+        # Merge both logs in relative path order. Each comparison row is written as [relative path, how the folders differ, number of hashes in the first folder, *hashes], and files only in one folder are written as requests to look up their content in the other.
+        while row1 is not None or row2 is not None:
+            in_folder_1 = row1 is not None and (row2 is None or row1[0] <= row2[0])
+            in_folder_2 = row2 is not None and (row1 is None or row2[0] <= row1[0])
+            if not in_folder_2:
+                writers['comparison'].writerow([row1[0], 'only_1', len(row1) - 1] + row1[1:])
+                writers['requests_2'].writerow([row_number] + row1[1:])
+            elif not in_folder_1:
+                writers['comparison'].writerow([row2[0], 'only_2', 0] + row2[1:])
+                writers['requests_1'].writerow([row_number] + row2[1:])
+            else:
+                difference = 'modified' if row1[1:] != row2[1:] else 'duplicate'
+                writers['comparison'].writerow([row1[0], difference, len(row1) - 1] + row1[1:] + row2[1:])
+
+            if in_folder_1:
+                writers['folder_1'].writerow(row1)
+                row1 = next(rows1, None)
+            if in_folder_2:
+                writers['folder_2'].writerow(row2)
+                row2 = next(rows2, None)
+            row_number += 1
+        for f in files.values():
+            f.close()
+
+        # Look up the content of files only in one folder in the other, then sort the matches back into relative path order.
+        matches = external_sort(
+            (match for folder in ['1', '2'] for match in
+             find_moved_files(paths[f'requests_{folder}'], paths[f'folder_{folder}'], temp_folder)),
+            lambda row: int(row[0]), temp_folder)
+        match = next(matches, None)
+
+        empty = [''] * len(HASH_ALGORITHMS)
+        for row_number, (key, difference, hash_count, *hashes) in enumerate(read_temporary_rows(paths['comparison'])):
+            matching_path = ''
+            if match is not None and int(match[0]) == row_number:
+                matching_path = match[1]
+                match = next(matches, None)
+
+            if difference == 'only_2' and matching_path:
+                status = f'Moved/Renamed - Content present in {no_space_name(folder_1)} under another path'
+            elif difference == 'only_2':
+                status = f'Unique - Only in {no_space_name(folder_2)}'
+            elif difference == 'only_1' and matching_path:
+                status = f'Moved/Renamed - Content present in {no_space_name(folder_2)} under another path'
+            elif difference == 'only_1':
+                status = f'Unique - Only in {no_space_name(folder_1)}'
+            elif difference == 'modified':
+                status = 'Modified - Hash mismatch between folders'
+            else:
+                status = 'Duplicate - Present in both folders'
+
+            value1 = hashes[:int(hash_count)] if difference != 'only_2' else empty
+            value2 = hashes[int(hash_count):] if difference != 'only_1' else empty
+            yield (key, *value1, *value2, status, matching_path)
+
+# Encode an entry of a folder, either a file's name and hashes or a subfolder's name and digest, to be added to its folder's digest. Names and values are prefixed with their lengths, so no two different entries encode the same way.
+def encode_folder_entry(kind, name, digests):
+    value = '\0'.join(digests)
+    return f'{kind}{len(name)}:{name}{len(value)}:{value}'.encode('utf-8', 'surrogatepass')
+
+# Close the innermost open folder while generating folder digests, adding its digest and file count to the folder holding it and returning its row.
+def close_folder_digest(folders, top_folder):
+    name, hasher, file_count = folders.pop()
+    digest = hasher.hexdigest()
+    parent = folders[-1] if folders else top_folder
+    parent[1].update(encode_folder_entry('D', name, [digest]))
+    parent[2] += file_count
+    return [os.sep.join([folder[0] for folder in folders] + [name]), digest, file_count]
+
+# Generate a Merkle digest for every folder listed in a hash CSV, yielding [relative path, digest, number of files] for each folder once all of its contents have been read, and '.' for the top folder last. A folder's digest is the SHA-256 of its entries in relative path order, each a file's name and hashes or a subfolder's name and digest, so two folders share a digest only if they hold the same names with the same content. Sorted by relative path, every folder's contents are next to each other, so only the folders holding the current file are kept open, and the CSV is sorted on disk so little memory is needed however many files it lists.
+def generate_folder_digests(csv_path, temp_folder):
+    top_folder = ['.', hashlib.sha256(), 0]
+    folders = []
+    for row in read_hash_csv_by_path(csv_path, temp_folder):
+        *parents, name = row[0].split(os.sep)
+        # Close the open folders that do not hold this file, then open those that do.
+        common = 0
+        while common < min(len(folders), len(parents)) and folders[common][0] == parents[common]:
+            common += 1
+        while len(folders) > common:
+            yield close_folder_digest(folders, top_folder)
+        for folder_name in parents[common:]:
+            folders.append([folder_name, hashlib.sha256(), 0])
+        folder = folders[-1] if folders else top_folder
+        folder[1].update(encode_folder_entry('F', name, row[1:]))
+        folder[2] += 1
+    while folders:
+        yield close_folder_digest(folders, top_folder)
+    yield ['.', top_folder[1].hexdigest(), top_folder[2]]
+
+# Write the folder digests of a hash CSV to a new CSV log.
+def write_folder_digests_to_csv(csv_path, output_path):
+    with tempfile.TemporaryDirectory(dir=SORT_TEMP_FOLDER or None) as temp_folder:
+        with open(output_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Relative_Path', 'Folder_Digest', 'Files'])
+            writer.writerows(generate_folder_digests(csv_path, temp_folder))
+
+# Load a folder digests CSV into a dictionary of (digest, number of files) keyed by relative path.
+def load_folder_digests(csv_path):
+    with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+        return {row['Relative_Path']: (row['Folder_Digest'], int(row['Files'])) for row in csv.DictReader(f)}
+
+# Descend the folder digest trees of both logs from their top folders, returning the folders whose digests match (in relative path order), and the folders whose digests differ or which are only in one log. Folders within a matching folder are not visited, as they must match too.
+def find_differing_folders(digests1, digests2):
+    subfolders = {}
+    for path in digests1.keys() | digests2.keys():
+        if path != '.':
+            subfolders.setdefault(os.path.dirname(path) or '.', []).append(path)
+    identical = []
+    differing = set()
+    folders = ['.']
+    while folders:
+        path = folders.pop()
+        if path in digests1 and digests1[path] == digests2.get(path) and digests1[path][1]:
+            identical.append(path)
+        else:
+            differing.add(path)
+            folders.extend(subfolders.get(path, []))
+    # A folder's files all sort after its relative path and a separator, which is where its row goes.
+    identical.sort(key=lambda path: path + os.sep)
+    return identical, differing
+
+# Compare the logs folder by folder using their folder digests ('--by-folder'). The folder digest trees are descended from the top folders, only into folders whose digests differ. A folder with the same digest in both is reported as a single row in place of the rows for each of its files, so folders that match are proven identical from one row per folder, and if the top folders match the hash logs are not read at all. Only the files directly within folders that differ are read from the logs and compared, by the given comparison (compare_hash_csvs or compare_hash_csvs_external), so a file is only reported as moved or renamed if its content is found in one of those folders. Rows are yielded in relative path order.
+def compare_hash_csvs_by_folder(csv1, folders_csv1, csv2, folders_csv2, compare=compare_hash_csvs):
+    digests1 = load_folder_digests(folders_csv1)
+    digests2 = load_folder_digests(folders_csv2)
+    identical, differing = find_differing_folders(digests1, digests2)
+    empty = ('',) * (2 * len(HASH_ALGORITHMS))
+
+    identical_rows = ((path + os.sep, (path, *empty, f'Identical folder - All {digests1[path][1]} files present in both folders', ''))
+                      for path in identical)
+    if not differing:
+        yield from (row for _, row in identical_rows)
+        return
+    compared_rows = ((row[0], row) for row in compare(csv1, csv2, differing))
+    for _, row in heapq.merge(identical_rows, compared_rows, key=lambda item: item[0]):
+        yield row
+
+# Write results from hash comparison to a new CSV log, recording them in the manifest store too if it is open. Files present in both folders (or in identical folders) are the only rows not counted as mismatches.
+def write_hash_comparison_to_csv(hash_evaluation, output_path):
+    columns = (['Relative_Path']
+               + [f'Folder1_{hash_label(algorithm)}' for algorithm in HASH_ALGORITHMS]
+               + [f'Folder2_{hash_label(algorithm)}' for algorithm in HASH_ALGORITHMS]
+               + ['Status', 'Matching_Path'])
+    start_store_run(output_path, columns, 'Relative_Path',
+                    [f'Folder1_{hash_label(HASH_ALGORITHMS[0])}', f'Folder2_{hash_label(HASH_ALGORITHMS[0])}'])
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for evaluation in hash_evaluation:
+            writer.writerow(evaluation)
+            store_row(dict(zip(columns, evaluation)), not evaluation[-2].startswith(('Duplicate', 'Identical')))
+    finish_store_run()
+
+# Print each row of a hash comparison as it is passed on, so the comparison can be printed while it is written without being held in memory.
+def print_hash_comparison(hash_evaluation):
+    for diff in hash_evaluation:
+        rel_path, *hashes, status, matching_path = diff
+        print(f'- {rel_path} | {status}' + (f' ({matching_path})' if matching_path else ''))
+        yield diff
+
+# Generate an MD5 hash of only the first and last PARTIAL_HASH_BYTES of a file, a cheap way to rule out files that share a size but not their content. Files of up to twice PARTIAL_HASH_BYTES are read in full, so for them this is their full MD5 hash.
+def generate_partial_md5(file_path, file_size):
+    hasher = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        hasher.update(f.read(PARTIAL_HASH_BYTES))
+        if file_size > PARTIAL_HASH_BYTES:
+            f.seek(max(PARTIAL_HASH_BYTES, file_size - PARTIAL_HASH_BYTES))
+            hasher.update(f.read(PARTIAL_HASH_BYTES))
+    return hasher.hexdigest()
+
+# Find files with duplicate content across both folders in stages, so that as little as possible is read: group files by size from a stat-only scan, then group files whose sizes collide by a partial hash, and only generate full MD5 hashes for files that still collide. Files with a unique size are never read.
+def find_duplicates(folder_1, folder_2):
+    files_by_size = {}
+    for folder in (folder_1, folder_2):
+        for entry in walk_files(folder):
+            files_by_size.setdefault(entry.st_size, []).append((folder, entry))
+
+    files_by_partial_hash = {}
+    for file_size, entries in files_by_size.items():
+        if len(entries) < 2:
+            continue
+        for folder, entry in entries:
+            future = get_hash_pool(entry.st_dev).submit(generate_partial_md5, entry.path, file_size)
+            files_by_partial_hash.setdefault(file_size, []).append((folder, entry, future))
+
+    files_by_hash = {}
+    full_hash_needed = {}
+    for file_size, entries in files_by_partial_hash.items():
+        groups = {}
+        for folder, entry, future in entries:
+            groups.setdefault(future.result(), []).append((folder, entry))
+        for partial_hash, group in groups.items():
+            if len(group) < 2:
+                continue
+            if file_size <= 2 * PARTIAL_HASH_BYTES:
+                files_by_hash.setdefault(partial_hash, []).extend(group)
+            else:
+                full_hash_needed.update((entry, folder) for folder, entry in group)
+
+    for entry, file_hashes in generate_hashes_in_order(list(full_hash_needed)):
+        files_by_hash.setdefault(file_hashes['md5'], []).append((full_hash_needed[entry], entry))
+    shutdown_hash_pools()
+
+    duplicates = []
+    group_number = 0
+    for file_hash, group in files_by_hash.items():
+        if len(group) < 2:
+            continue
+        group_number += 1
+        for folder, entry in group:
+            duplicates.append((group_number, no_space_name(folder), entry.relative_path, entry.st_size, file_hash))
+    return duplicates
+
+# Write groups of files with duplicate content to a new CSV log.
+def write_duplicates_to_csv(duplicates, output_path):
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Duplicate_Group', 'Folder', 'Relative_Path', 'Size', 'MD5_Hash'])
+        writer.writerows(duplicates)
+
+###############################################
+# Execution of functions using user-specified paths occurs below, provided the user supplies valid paths. This is guarded so that worker processes used for checksum generation do not re-run it.
+
+if __name__ == '__main__':
+    # Invalidate cached hashes, or query the manifest store, instead of running a comparison if requested.
+    run_clear_hash_cache_command()
+    run_manifest_store_command()
+
+    # Get user variables (folder names).
+    folder_1 = input('Enter first folder file path for analysis: ').strip()
+    folder_2 = input('Enter second folder file path for analysis: ').strip()
+
+    folders_exist = check_path_exists(folder_1) and check_path_exists(folder_2)
+
+    if folders_exist and '--dedup' in sys.argv:
+        print('\nBoth folders exist, proceeding with content-dedup analysis...')
+
+        script_dir = get_script_directory()
+        logs_dir = os.path.join(script_dir, "compare_logs")
+        os.makedirs(logs_dir, exist_ok=True)
+        today_date = datetime.date.today().strftime("%d-%m-%Y")
+        duplicates_path = os.path.join(logs_dir, f"duplicates_report_{no_space_name(folder_1)}_vs_{no_space_name(folder_2)}_{today_date}.csv")
+
+        # Find duplicate content, only reading files whose sizes (and then partial hashes) collide.
+        open_hash_cache()
+        try:
+            duplicates = find_duplicates(folder_1, folder_2)
+        finally:
+            close_hash_cache()
+
+        print(f'\n Writing duplicates report to {duplicates_path}...')
+        write_duplicates_to_csv(duplicates, duplicates_path)
+
+        for group_number, folder_label, rel_path, file_size, file_hash in duplicates:
+            print(f'- Group {group_number} | {folder_label} | {rel_path}')
+
+    elif folders_exist:
+        print('\nBoth folders exist, proceeding with checksum generation...')
+
+        # Set up CSV filenames to write to.
+        script_dir = get_script_directory()
+        logs_dir = os.path.join(script_dir, "compare_logs")
+        os.makedirs(logs_dir, exist_ok=True)
+        today_date = datetime.date.today().strftime("%d-%m-%Y")
+        csv1_path = os.path.join(logs_dir, f"{no_space_name(folder_1)}_hashes_{today_date}.csv")
+        csv2_path = os.path.join(logs_dir, f"{no_space_name(folder_2)}_hashes_{today_date}.csv")
+        report_path = os.path.join(logs_dir, f"comparison_report_{no_space_name(folder_1)}_vs_{no_space_name(folder_2)}_{today_date}.csv")
+
+        # Run function to write hashes for user input into CSV files.
+        print('\n Creating CSV logs with checksums for every file in each folder...')
+        open_hash_cache()
+        start_progress('Hashing')
+        try:
+            write_both_hashes_to_csv(folder_1, csv1_path, folder_2, csv2_path)
+        finally:
+            close_hash_cache()
+
+        # Set up variables to establishes discrepancies, sorting the logs on disk rather than in memory if requested.
+        compare = compare_hash_csvs_external if '--external-sort' in sys.argv else compare_hash_csvs
+        if '--by-folder' in sys.argv:
+            # Write the digests of every folder and report folders that match as a single row.
+            folders1_path = os.path.join(logs_dir, f"{no_space_name(folder_1)}_folder_digests_{today_date}.csv")
+            folders2_path = os.path.join(logs_dir, f"{no_space_name(folder_2)}_folder_digests_{today_date}.csv")
+            print('\n Creating CSV logs with digests for every folder...')
+            write_folder_digests_to_csv(csv1_path, folders1_path)
+            write_folder_digests_to_csv(csv2_path, folders2_path)
+            evaluation = compare_hash_csvs_by_folder(csv1_path, folders1_path, csv2_path, folders2_path, compare)
+        else:
+            evaluation = compare(csv1_path, csv2_path)
+
+        # Deploy function to write reports for any discrepancies identified, printing each row as it is written.
+        print(f'\n Writing full comparison report to {report_path}...')
+        if RECORD_RUNS:
+            open_manifest_store()
+        try:
+            write_hash_comparison_to_csv(print_hash_comparison(evaluation), report_path)
+        finally:
+            close_manifest_store()
+
+    else:
+        print('\n One or both folder paths are invalid. Exiting...')
+        sys.exit(1)
@@ -1,101 +1,153 @@
-import os
-import sys
-import datetime
-
-# Import key shared functions from structure_SIPs_utils.py.
-from structure_SIPs_utils import (
-    get_script_directory,
-    check_path_exists,
-    list_all_files,
-    no_space_name,
-    write_source_hashes_to_csv,
-    compare_hashes
-)
-
-# Import all handlers to determine script behaviour based on cataloguing system (TMS, Koha or Calm) and intended folder structure (Standard or PAX).
-from tms_std    import validate_opex_files as validate_tms_std,    secure_copy as secure_copy_tms_std
-from tms_pax    import validate_opex_files_pax as validate_tms_pax,    secure_copy as secure_copy_tms_pax
-from koha_std   import validate_opex_files as validate_koha_std,   secure_copy as secure_copy_koha_std
-from koha_pax   import validate_opex_files_pax as validate_koha_pax,   secure_copy as secure_copy_koha_pax
-from calm_std   import secure_copy as secure_copy_calm_std
-from calm_pax   import secure_copy as secure_copy_calm_pax
-
-# Function to prompt user for inputs for source/destination directories, cataloguing system and intended folder structure, which will determine appropriate handlers as outlined above.
-def get_user_inputs():
-    source = input('Enter source path name (i.e. the content you want to restructure to be Preservica-friendly): ').strip()
-    destination = input('Enter destination file path (i.e. the place you want your Preservica-friendly folder structure to be created): ').strip()
-    # Get user variable for catalogue using a controlled vocabulary.
-    acceptable_catalogue_values = ['TMS', 'Koha', 'Calm']
-    while True:
-        catalogue = input('Which system has the content been catalogued in? (TMS / Koha / Calm): ').strip()
-        if catalogue in acceptable_catalogue_values:
-            break
-        else:
-            print(
-                'Input is not included in options. Please try again -- refer to options in brackets (TMS / Koha / Calm) and be mindful of case.')
-    # Get user variable for desired structure using a controlled vocabulary.
-    acceptable_structure_values = ['Standard', 'PAX']
-    while True:
-        structure = input('What type of folder structure do you need? (Standard / PAX): ').strip()
-        if structure in acceptable_structure_values:
-            break
-        else:
-            print(
-                'Input is not included in options. Please try again -- refer to options in brackets (Standard / PAX) and be mindful of case.')
-    return source, destination, catalogue, structure
-
-# Function for main script, which instructs bulk of execution (i.e. validation, organising, copying, logging and integrity checking).
-def main():
-    source, destination, catalogue, structure = get_user_inputs()
-
-    # Ensure the source/destination paths supplied by user are indeed valid. If not, exit script execution.
-    if not (check_path_exists(source) and check_path_exists(destination)):
-        print("Source and/or directory path(s) are invalid. Please amend invalid path(s) and rerun script.")
-        sys.exit(1)
-
-    files = list_all_files(source)
-
-    # Ensure existence of or create a logs folder in the same location as the main script.
-    script_dir = get_script_directory()
-    logs_dir = os.path.join(script_dir, 'copy_logs')
-    os.makedirs(logs_dir, exist_ok=True)
-
-    # Create a unique log filename for this run of main script.
-    today_date = datetime.date.today().strftime("%d-%m-%Y")
-    source_label = no_space_name(os.path.basename(source))
-    destination_label = no_space_name(os.path.basename(destination))
-    log_file = os.path.join(logs_dir,
-                            f"copyLog_{source_label}_to_{destination_label}_{today_date}.csv")
-
-    # Write source hashes to the CSV log file.
-    write_source_hashes_to_csv(files, source, log_file)
-
-    # For TMS and Koha material, ensure presence of an OPEX metadata file prior to copying any content, using appropriate validation handler.
-    if catalogue in ('TMS', 'Koha'):
-        if structure == 'Standard':
-            validate_tms_std(source, files) if catalogue=='TMS' else validate_koha_std(source, files)
-        else:
-            validate_tms_pax(source, files, destination) if catalogue=='TMS' else validate_koha_pax(source, files)
-    else:  # Calm
-        pass
-
-    # Secure copy digital content from source directory to destination directory in accordance with appropriate copy handler, logging progress in the CSV log file.
-    if catalogue == 'TMS' and structure == 'Standard':
-        secure_copy_tms_std(source, destination, log_file)
-    elif catalogue == 'TMS' and structure == 'PAX':
-        secure_copy_tms_pax(source, destination, log_file)
-    elif catalogue == 'Koha' and structure == 'Standard':
-        secure_copy_koha_std(source, destination, log_file)
-    elif catalogue == 'Koha' and structure == 'PAX':
-        secure_copy_koha_pax(source, destination, log_file)
-    elif catalogue == 'Calm' and structure == 'Standard':
-        secure_copy_calm_std(source, destination, log_file)
-    else:
-        secure_copy_calm_pax(source, destination, log_file)
-
-    # Compare hashes from source directory and destination directory to ensure all content has been safely copied over.
-    compare_hashes(log_file)
-
-# Execute main script.
-if __name__ == '__main__':
+import os
+import sys
+import datetime
+
+# Import key shared functions from structure_SIPs_utils.py.
+from structure_SIPs_utils import (
+    get_script_directory,
+    check_path_exists,
+    walk_files,
+    start_progress,
+    no_space_name,
+    open_hash_cache,
+    close_hash_cache,
+    open_manifest_store,
+    close_manifest_store,
+    open_copy_journal,
+    close_copy_journal,
+    run_clear_hash_cache_command,
+    run_manifest_store_command,
+    execute_copy_plan,
+    record_copy_throughput,
+    report_dry_run,
+    report_file_formats,
+    report_mismatches,
+    report_timings,
+    RECORD_RUNS
+)
+
+# Import all handlers to determine script behaviour based on cataloguing system (TMS, Koha or Calm) and intended folder structure (Standard or PAX).
+from tms_std    import validate_opex_files as validate_tms_std,    plan_copies as plan_copies_tms_std
+from tms_pax    import validate_opex_files_pax as validate_tms_pax,    plan_copies as plan_copies_tms_pax
+from koha_std   import validate_opex_files as validate_koha_std,   plan_copies as plan_copies_koha_std
+from koha_pax   import validate_opex_files_pax as validate_koha_pax,   plan_copies as plan_copies_koha_pax
+from calm_std   import plan_copies as plan_copies_calm_std
+from calm_pax   import plan_copies as plan_copies_calm_pax
+
+# Function to prompt user for inputs for source/destination directories, cataloguing system and intended folder structure, which will determine appropriate handlers as outlined above.
+def get_user_inputs():
+    source = input('Enter source path name (i.e. the content you want to restructure to be Preservica-friendly): ').strip()
+    destination = input('Enter destination file path (i.e. the place you want your Preservica-friendly folder structure to be created): ').strip()
+    # Get user variable for catalogue using a controlled vocabulary.
+    acceptable_catalogue_values = ['TMS', 'Koha', 'Calm']
+    while True:
+        catalogue = input('Which system has the content been catalogued in? (TMS / Koha / Calm): ').strip()
+        if catalogue in acceptable_catalogue_values:
+            break
+        else:
+            print(
+                'Input is not included in options. Please try again -- refer to options in brackets (TMS / Koha / Calm) and be mindful of case.')
+    # Get user variable for desired structure using a controlled vocabulary.
+    acceptable_structure_values = ['Standard', 'PAX']
+    while True:
+        structure = input('What type of folder structure do you need? (Standard / PAX): ').strip()
+        if structure in acceptable_structure_values:
+            break
+        else:
+            print(
+                'Input is not included in options. Please try again -- refer to options in brackets (Standard / PAX) and be mindful of case.')
+    return source, destination, catalogue, structure
+
+# Function for main script, which instructs bulk of execution (i.e. validation, organising, copying, logging and integrity checking).
+def main():
+    # Invalidate cached hashes, or query the manifest store, instead of restructuring content if requested.
+    run_clear_hash_cache_command()
+    run_manifest_store_command()
+
+    source, destination, catalogue, structure = get_user_inputs()
+
+    # Ensure the source/destination paths supplied by user are indeed valid. If not, exit script execution.
+    if not (check_path_exists(source) and check_path_exists(destination)):
+        print("Source and/or directory path(s) are invalid. Please amend invalid path(s) and rerun script.")
+        sys.exit(1)
+
+    # Walk the source folder once with os.scandir, keeping each file's entry (path and stat) for validation and copying.
+    entries = list(walk_files(source))
+    files = [entry.path for entry in entries]
+
+    # Ensure existence of or create a logs folder in the same location as the main script.
+    script_dir = get_script_directory()
+    logs_dir = os.path.join(script_dir, 'copy_logs')
+    os.makedirs(logs_dir, exist_ok=True)
+
+    # Create a unique log filename for this run of main script.
+    today_date = datetime.date.today().strftime("%d-%m-%Y")
+    source_label = no_space_name(os.path.basename(source))
+    destination_label = no_space_name(os.path.basename(destination))
+    log_file = os.path.join(logs_dir,
+                            f"copyLog_{source_label}_to_{destination_label}_{today_date}.csv")
+    # The copy journal is named without a date so that an interrupted run can be resumed on a later day.
+    journal_file = os.path.join(logs_dir, f"copyJournal_{source_label}_to_{destination_label}.csv")
+    dry_run = '--dry-run' in sys.argv
+
+    # For TMS and Koha material, ensure presence of an OPEX metadata file prior to copying any content, using appropriate validation handler.
+    if catalogue in ('TMS', 'Koha'):
+        if structure == 'Standard':
+            validate_tms_std(source, files) if catalogue=='TMS' else validate_koha_std(source, files)
+        else:
+            validate_tms_pax(source, files) if catalogue=='TMS' else validate_koha_pax(source, files)
+    else:  # Calm
+        pass
+
+    # Plan where every file will be copied to in accordance with appropriate handler, before anything is copied.
+    if catalogue == 'TMS' and structure == 'Standard':
+        plan = plan_copies_tms_std(source, destination, entries)
+    elif catalogue == 'TMS' and structure == 'PAX':
+        plan = plan_copies_tms_pax(source, destination, entries)
+    elif catalogue == 'Koha' and structure == 'Standard':
+        plan = plan_copies_koha_std(source, destination, entries)
+    elif catalogue == 'Koha' and structure == 'PAX':
+        plan = plan_copies_koha_pax(source, destination, entries)
+    elif catalogue == 'Calm' and structure == 'Standard':
+        plan = plan_copies_calm_std(source, destination, entries)
+    else:
+        plan = plan_copies_calm_pax(source, destination, entries)
+
+    # Report what the copy would do without copying anything if requested, exiting with an error if the destination is short of space.
+    if dry_run:
+        dry_run_file = os.path.join(logs_dir, f"dryRun_{source_label}_to_{destination_label}_{today_date}.csv")
+        open_hash_cache()
+        try:
+            enough_space = report_dry_run(plan, source, destination, dry_run_file, check_formats=structure == 'PAX')
+        finally:
+            close_hash_cache()
+        sys.exit(0 if enough_space else 1)
+
+    # Secure copy digital content from source directory to destination directory by executing the plan, generating source hashes as content is copied and logging progress in the CSV log file.
+    open_hash_cache()
+    if RECORD_RUNS:
+        open_manifest_store()
+    open_copy_journal(journal_file, '--resume' in sys.argv)
+    start_progress('Copying', len(entries), sum(entry.st_size for entry in entries))
+    try:
+        mismatches = execute_copy_plan(plan, log_file, check_formats=structure == 'PAX')
+        # Remember how fast this copy ran for dry runs, unless files copied by an earlier run were skipped.
+        if '--resume' not in sys.argv:
+            record_copy_throughput(source, destination)
+    finally:
+        close_copy_journal()
+        close_manifest_store()
+        close_hash_cache()
+
+    # Report on any files whose source and destination hashes do not match, to ensure all content has been safely copied over.
+    report_mismatches(mismatches)
+
+    # Report on any files copied whose content does not match their extension.
+    report_file_formats()
+
+    # Report on where time was spent copying, if timings were requested with '--timings'.
+    report_timings()
+
+# Execute main script.
+if __name__ == '__main__':
     main()
\ No newline at end of file
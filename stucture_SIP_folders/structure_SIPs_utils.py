@@ -1,146 +1,1561 @@
-import os
-import shutil
-import sys
-import hashlib
-import csv
-
-# Below are functions that are common to all or most use-cases, regardless of catalogue/structure input.
-
-# Return the directory where the calling script is located.
-def get_script_directory():
-    print('\n Locating script directory...')
-    return os.path.dirname(os.path.realpath((sys.argv[0])))
-
-# Return 'True' if the path supplied exists on the disk.
-def check_path_exists(path: str):
-    print('\n Checking for existence of "' + path + "'...")
-    return os.path.exists(path)
-
-
-# Recursively walk a directory and return a list of all file paths within a directory.
-def list_all_files(folder_path):
-    all_files = []
-    for root, _, files in os.walk(folder_path):
-        for f in files:
-            all_files.append(os.path.join(root, f))
-    return all_files
-
-
-# Generate MD5 hashes for folder contents.
-def generate_md5(file_path):
-    hasher = hashlib.md5()
-    with open(file_path, 'rb') as f:
-        chunk = f.read(4096)
-        while len(chunk) > 0:
-            hasher.update(chunk)
-            chunk = f.read(4096)
-    return hasher.hexdigest()
-
-
-# Ensure there are no spaces or issue characters in filename for CSV log file by stripping directories and replacing spaces with underscores.
-def no_space_name(path):
-    return os.path.basename(os.path.normpath(path)).replace(" ", "_")
-
-
-# Create a CSV to write filepaths and file hashes to.
-def write_source_hashes_to_csv(file_list, base_folder, csv_path):
-
-    with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['Relative_SourcePath', 'Source_MD5'])
-
-        for file_path in file_list:
-            relative_path = os.path.relpath(file_path, base_folder)
-            file_hash = generate_md5(file_path)
-            writer.writerow([relative_path, file_hash])
-
-# Below are functions shared across use-cases that require a multi-asset ('PAX') folder structure.
-
-# Mappings to support PAX folder structuring, determining what file formats there are and whether they are access/preservation formats.
-file_format_mapping = {
-    'image': ['jpeg', 'jpg', 'png', 'tiff', 'tif'],
-    'document': ['doc', 'docx', 'pdf'],
-    'audio': ['mp3', 'wav', 'aiff'],
-    'video': ['mp4', 'mkv', 'mov']
-}
-
-representation_mapping = {
-    'access': ['jpeg', 'jpg', 'png', 'pdf', 'mp3', 'mp4'],
-    'preservation': ['tiff', 'tif', 'doc', 'docx', 'wav', 'aiff', 'mkv', 'mov']
-}
-
-# Based on above mapping, extract the file format.
-def get_file_format(ext):
-    for file_format, extensions in file_format_mapping.items():
-        if ext.lower() in extensions:
-            return file_format.capitalize()
-    return "Unknown"
-
-# Based on above mapping, interpret whether file formats present and access or preservation copies.
-def determine_representation(ext):
-    ext = ext.lower()
-    if ext in representation_mapping['access']:
-        return 'Representation_Access'
-    elif ext in representation_mapping['preservation']:
-        return 'Representation_Preservation'
-    return None
-
-# Distribute file into DPS-friendly multi-part asset (PAX) folder structure.
-def distribute_file(source_file, filename_prefix, base_output_dir, *, legacy_nested=False):
-    extension = source_file.split('.')[-1].lower()
-    representation = determine_representation(extension)
-
-    if not representation:
-        return None
-
-    file_format = get_file_format(extension)
-
-    if legacy_nested:
-        top_level = os.path.join(base_output_dir, filename_prefix)
-        pax_root = os.path.join(top_level, f"{filename_prefix}.pax")
-    else:
-        pax_root = os.path.join(base_output_dir, f"{filename_prefix}.pax")
-
-    destination_folder = os.path.join(pax_root, representation, file_format)
-    os.makedirs(destination_folder, exist_ok=True)
-
-    shutil.copy2(source_file, os.path.join(destination_folder, os.path.basename(source_file)))
-    return destination_folder
-
-# Compare hashes between source and destination directories, reporting on any missing/corrupt files in the log file and print statement.
-def compare_hashes(csv_path):
-    rows = []
-
-    with open(csv_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            path1 = row.get('Source_MD5', '')
-            path2 = row.get('Destination_MD5', '')
-            if not path1:
-                status = 'Missing source hash'
-            elif not path2:
-                status = 'Missing destination hash'
-            elif path1 != path2:
-                status = 'Hash mismatch'
-            else:
-                status = 'MATCH'
-            row['Status'] = status
-            rows.append(row)
-
-    # Add to CSV to include match_status
-    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
-        field_labels = rows[0].keys()
-        writer = csv.DictWriter(f, fieldnames=field_labels)
-        writer.writeheader()
-        writer.writerows(rows)
-
-    # Write print statement to report on copy workflow results.
-    mismatches = [r for r in rows if r['Status'] != 'MATCH']
-
-    if mismatches:
-        print('\n Mismatched or missing files detected:')
-        for entry in mismatches:
-            print(f" - {entry['Relative_SourcePath']}: Source Hash = {entry['Source_MD5']}, "
-                  f"Destination Hash = {entry['Destination_MD5']}, Status = {entry['Status']}")
-    else:
-        print('\n All files copied and verified successfully.')
\ No newline at end of file
+import os
+import shutil
+import sys
+import hashlib
+import csv
+import datetime
+import threading
+from collections import deque, namedtuple, Counter
+import queue
+from array import array
+from bisect import bisect_left
+import heapq
+import time
+import sqlite3
+import mmap
+import errno
+import re
+# fcntl is only available on Unix-like systems, where it is used to clone files on copy-on-write file systems.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+# Settings for checksum generation: the type of worker pool used to hash files ('thread' or 'process') and the maximum number of workers hashing files on any one storage device.
+HASH_POOL = 'thread'
+HASH_WORKERS_PER_DEVICE = 4
+
+# Settings for fixity: the hashlib algorithms generated from every read of a file, each logged in its own CSV column. The first algorithm listed is the one shown in mismatch reports; add 'blake2b' (or any other hashlib algorithm) for stronger fixity at the cost of CPU rather than disk reads.
+HASH_ALGORITHMS = ['md5', 'sha256']
+
+# Settings for reading files: the size of the buffer each worker reuses for every read, and how files are read for hashing ('read' allocates a new chunk for every read, 'readinto' fills the reusable buffer, 'mmap' maps the file into memory and is best kept for local disks). Run benchmark_hashing.py to compare the strategies on your own storage.
+HASH_BUFFER_SIZE = 1024 * 1024
+HASH_READ_STRATEGY = 'readinto'
+
+# Settings for the operating system's page cache: whether files are dropped from the cache once they have been read, so that a bulk run does not push out the files other work on the same server is using, and how copies are read back to verify them. 'cached' reads the copy back as written, which usually comes straight from memory rather than storage; 'fadvise' forces the copy to disk and drops it from the cache before reading it back, so it is read from storage; 'direct' also forces it to disk, then reads it back with O_DIRECT, bypassing the cache entirely (falling back to 'fadvise' on file systems that do not support it). Where the cache cannot be dropped (e.g. on Windows), copies are still forced to disk but may be read back from memory. Forcing every copy to disk slows down runs of many small files and copies to network shares, so both are off by default.
+DROP_CACHE_AFTER_READ = False
+VERIFY_READ_MODE = 'cached'
+
+# Settings for copying: the ways of copying a file to try, fastest first. 'reflink' clones the file on copy-on-write file systems such as btrfs and XFS, 'copy_file_range' and 'sendfile' copy inside the kernel, and 'userspace' reads the file through the scripts (hashing the source from the same read). Any that are unavailable or fail for a file are skipped. As the source must be read to hash it anyway, 'copy_file_range' and 'sendfile' are only used for files whose hashes are already in the hash cache, and 'reflink' only for those or for files on the same storage device, so that no file is read twice.
+COPY_BACKENDS = ['reflink', 'copy_file_range', 'sendfile', 'userspace']
+
+# Settings for the persistent hash cache: its location (by default the folder holding compare_hashes.py and safe_copy.py, next to their logs folders, so that compare_hashes.py, safe_copy.py and structure_SIPs.py all share one cache; set the HASH_CACHE_FILE environment variable to keep it elsewhere), the size in megabytes beyond which the least recently used files are forgotten, and how often (in files hashed or reused, or in seconds) its changes are committed.
+HASH_CACHE_FILE = os.environ.get('HASH_CACHE_FILE', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'hash_cache.sqlite'))
+HASH_CACHE_MAX_MB = 1024
+HASH_CACHE_COMMIT_FILES = 1000
+HASH_CACHE_COMMIT_SECONDS = 1.0
+
+# Settings for the manifest store: its location (by default the folder holding compare_hashes.py and safe_copy.py, next to the hash cache, so that compare_hashes.py, safe_copy.py and structure_SIPs.py all share one store; set the MANIFEST_STORE_FILE environment variable to keep it elsewhere) and whether every CSV log is also recorded in it, as a table indexed on relative path, checksum and mismatches, so runs can be queried without reading their CSV logs.
+MANIFEST_STORE_FILE = os.environ.get('MANIFEST_STORE_FILE', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'manifest_store.sqlite'))
+RECORD_RUNS = True
+
+# Settings for the CSV log: the maximum number of copied files that may be waiting on verification before the log writer waits for them, which keeps memory use flat however many files are copied.
+LOG_QUEUE_SIZE = 1000
+
+# Settings for timing: whether the CSV log gets per-file timing columns and the run ends with a timing summary (turned on by running with '--timings'), and how many of the slowest files the summary lists.
+LOG_TIMINGS = '--timings' in sys.argv
+SLOWEST_FILES_REPORTED = 10
+
+# Settings for progress: the minimum number of seconds between progress updates, which keeps printing them from slowing down runs of many small files.
+PROGRESS_INTERVAL = 5.0
+
+# Settings for walking folders: the maximum number of files found by a background walk that may be waiting to be hashed or copied.
+WALK_QUEUE_SIZE = 100000
+
+# Settings for dry runs (run with '--dry-run'): how many of the largest SIPs are listed, and for how many seconds the source is read to measure its speed when no earlier copy between the same drives has been timed.
+DRY_RUN_SIPS_SHOWN = 20
+DRY_RUN_SAMPLE_SECONDS = 10.0
+
+# Settings for identifying file formats for PAX folder structures: whether the first bytes of each file copied are checked against its extension, so misnamed files are reported, and whether files with an extension that is not mapped (which are not copied) are identified from their first bytes in the CSV log. The first bytes are taken from the first chunk already read to copy, hash or verify each file, so no file is read for this alone.
+IDENTIFY_FORMATS_FROM_CONTENT = True
+
+# Settings for the copy scheduler: the number of files that may be copied at once, and how many of those may read from any one source device or write to any one destination device. Small and large files (of at least LARGE_FILE_BYTES) have separate limits, so that many small files can be in flight on high-latency network shares while only a few large files compete for any one disk.
+COPY_WORKERS = 16
+SMALL_COPY_JOBS_PER_DEVICE = 8
+LARGE_COPY_JOBS_PER_DEVICE = 2
+LARGE_FILE_BYTES = 64 * 1024 * 1024
+
+# Below are functions that are common to all or most use-cases, regardless of catalogue/structure input.
+
+# Return the directory where the calling script is located.
+def get_script_directory():
+    print('\n Locating script directory...')
+    return os.path.dirname(os.path.realpath((sys.argv[0])))
+
+# Return 'True' if the path supplied exists on the disk.
+def check_path_exists(path: str):
+    print('\n Checking for existence of "' + path + "'...")
+    return os.path.exists(path)
+
+
+# A file found while walking a folder: its full and relative paths and the stat signature needed to hash, cache and copy it. The stat fields keep their os.stat names, so an entry can be used wherever a stat result is.
+FileEntry = namedtuple('FileEntry', ['path', 'relative_path', 'st_size', 'st_mtime_ns', 'st_ino', 'st_dev'])
+
+# Walk a folder with os.scandir, yielding an entry for every file as soon as it is found, in the same order as os.walk. Each file is only stat'ed once, and every file found is added to the progress totals.
+def walk_files(folder_path):
+    folders = [(folder_path, '')]
+    start_progress_scan()
+    try:
+        while folders:
+            subfolders = []
+            current_folder, relative_folder = folders.pop()
+            with os.scandir(current_folder) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        # Like os.walk, do not descend into symbolic links to folders.
+                        if not entry.is_symlink():
+                            subfolders.append((entry.path, relative_folder + entry.name + os.sep))
+                        continue
+                    # On Windows, os.scandir does not fill in the device and inode used by the hash cache.
+                    file_stat = os.stat(entry.path) if os.name == 'nt' else entry.stat()
+                    add_to_progress_total(file_stat.st_size)
+                    yield FileEntry(entry.path, relative_folder + entry.name, file_stat.st_size,
+                                    file_stat.st_mtime_ns, file_stat.st_ino, file_stat.st_dev)
+            folders.extend(reversed(subfolders))
+    finally:
+        finish_progress_scan()
+
+# Walk a folder in a background thread, yielding its entries as they are found so that hashing or copying can start before the walk is finished. The walk only runs up to WALK_QUEUE_SIZE files ahead.
+def walk_files_in_background(folder_path):
+    found = queue.Queue(maxsize=WALK_QUEUE_SIZE)
+    walk_finished = object()
+
+    def walk():
+        try:
+            for entry in walk_files(folder_path):
+                found.put(entry)
+            found.put(walk_finished)
+        except Exception as error:
+            found.put(error)
+
+    threading.Thread(target=walk, daemon=True).start()
+    while True:
+        entry = found.get()
+        if entry is walk_finished:
+            return
+        if isinstance(entry, Exception):
+            raise entry
+        yield entry
+
+# Progress of the current run against the totals found so far by walking the source folders, updated from every thread.
+progress = {}
+progress_lock = threading.Lock()
+
+# Start reporting progress of a task (e.g. 'Copying'). Totals already known can be given; otherwise they are added up as folders are walked.
+def start_progress(task, total_files=0, total_bytes=0):
+    now = time.monotonic()
+    with progress_lock:
+        progress.update(task=task, total_files=total_files, total_bytes=total_bytes, files=0, bytes=0, scans=0,
+                        start=now, last_update=now, last_bytes=0)
+    print(f'\n {task} files...')
+
+# Record that a folder walk has started, so progress reports totals as incomplete until it finishes.
+def start_progress_scan():
+    with progress_lock:
+        if progress:
+            progress['scans'] += 1
+
+# Add a file found by a folder walk to the progress totals.
+def add_to_progress_total(file_bytes):
+    with progress_lock:
+        if progress:
+            progress['total_files'] += 1
+            progress['total_bytes'] += file_bytes
+
+# Record that a folder walk has finished, announcing the totals once every walk has.
+def finish_progress_scan():
+    with progress_lock:
+        if progress and progress['scans'] > 0:
+            progress['scans'] -= 1
+            if progress['scans'] == 0:
+                print(f" Found {progress['total_files']} files ({progress['total_bytes'] / 1000000:.1f} MB).", flush=True)
+
+# Print a progress update: files and bytes done, the MB/s since the last update and the estimated time remaining at the average rate so far. Until the folders have been walked, the totals are those found so far and no estimate is given. Updates are printed on a single line when running in a terminal.
+def print_progress(now, final=False):
+    elapsed = now - progress['start']
+    rate = (progress['bytes'] - progress['last_bytes']) / 1000000 / max(now - progress['last_update'], 1e-9)
+    if final:
+        rate = progress['bytes'] / 1000000 / max(elapsed, 1e-9)
+    if progress['bytes'] and progress['total_bytes']:
+        remaining = elapsed * (progress['total_bytes'] - progress['bytes']) / progress['bytes']
+    elif progress['files']:
+        remaining = elapsed * (progress['total_files'] - progress['files']) / progress['files']
+    else:
+        remaining = 0
+    if final:
+        status = f'done in {datetime.timedelta(seconds=round(elapsed))}'
+    elif progress['scans']:
+        status = 'still walking folders'
+    else:
+        status = f'ETA {datetime.timedelta(seconds=round(max(remaining, 0)))}'
+    line = (f" {progress['task']}: {progress['files']}/{progress['total_files']} files, "
+            f"{progress['bytes'] / 1000000:.1f}/{progress['total_bytes'] / 1000000:.1f} MB, {rate:.1f} MB/s, {status}")
+    if sys.stdout.isatty():
+        print('\r' + line.ljust(100), end='\n' if final else '', flush=True)
+    else:
+        print(line, flush=True)
+
+# Record a file as done, printing a progress update if at least PROGRESS_INTERVAL seconds have passed since the last one. Does nothing if progress is not being reported.
+def update_progress(file_bytes):
+    with progress_lock:
+        if not progress:
+            return
+        progress['files'] += 1
+        progress['bytes'] += file_bytes
+        now = time.monotonic()
+        if now - progress['last_update'] >= PROGRESS_INTERVAL:
+            print_progress(now)
+            progress['last_update'] = now
+            progress['last_bytes'] = progress['bytes']
+
+# Files, bytes and seconds of the last task to finish reporting progress.
+completed_progress = {}
+
+# Print a final progress update and stop reporting progress, keeping the files, bytes and time taken.
+def finish_progress():
+    with progress_lock:
+        if progress:
+            now = time.monotonic()
+            print_progress(now, final=True)
+            completed_progress.update(files=progress['files'], bytes=progress['bytes'], seconds=now - progress['start'])
+            progress.clear()
+
+# Buffers for reading files, one per worker thread so each worker allocates its buffer once and reuses it for every file it reads.
+read_buffers = threading.local()
+
+# Return the calling thread's reusable read buffer as a memoryview of HASH_BUFFER_SIZE bytes.
+def get_read_buffer():
+    buffer = getattr(read_buffers, 'buffer', None)
+    if buffer is None or len(buffer) != HASH_BUFFER_SIZE:
+        buffer = memoryview(bytearray(HASH_BUFFER_SIZE))
+        read_buffers.buffer = buffer
+    return buffer
+
+# Buffers for reading files opened with O_DIRECT, one per worker thread. O_DIRECT reads must go into memory aligned to the storage's block size, which anonymous memory maps always are.
+direct_buffers = threading.local()
+
+# Return the calling thread's aligned read buffer as a memoryview of HASH_BUFFER_SIZE bytes.
+def get_direct_buffer():
+    buffer = getattr(direct_buffers, 'buffer', None)
+    if buffer is None or len(buffer) != HASH_BUFFER_SIZE:
+        buffer = memoryview(mmap.mmap(-1, HASH_BUFFER_SIZE))
+        direct_buffers.buffer = buffer
+    return buffer
+
+# Read an open file from its current position in chunks of up to HASH_BUFFER_SIZE bytes using the given strategy ('read', 'readinto', 'mmap', or 'direct' for files opened with O_DIRECT), yielding each chunk. Chunks yielded by 'readinto' and 'mmap' are views that are only valid until the next chunk is read, so they must be used straight away.
+def read_chunks(f, strategy=None):
+    strategy = strategy or HASH_READ_STRATEGY
+    if strategy == 'mmap':
+        # Empty files cannot be mapped, and there is nothing to read from them.
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # Every view of the mapping must be released before it can be closed.
+            with memoryview(mapped) as view:
+                for offset in range(f.tell(), len(mapped), HASH_BUFFER_SIZE):
+                    with view[offset:offset + HASH_BUFFER_SIZE] as chunk:
+                        yield chunk
+    elif strategy in ('readinto', 'direct'):
+        buffer = get_direct_buffer() if strategy == 'direct' else get_read_buffer()
+        size = f.readinto(buffer)
+        while size:
+            yield buffer[:size]
+            size = f.readinto(buffer)
+    else:
+        chunk = f.read(HASH_BUFFER_SIZE)
+        while len(chunk) > 0:
+            yield chunk
+            chunk = f.read(HASH_BUFFER_SIZE)
+
+# Advise the operating system that an open file's pages are no longer needed, so they are dropped from the page cache (pages written but not yet on disk are kept until they are). Does nothing where this is not supported.
+def drop_from_cache(fd):
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+# Generate hashes for folder contents with every algorithm in HASH_ALGORITHMS, feeding each chunk read to all of them so the file is only read once. With the 'direct' strategy the file is opened with O_DIRECT, bypassing the page cache, unless its file system does not support it. The file is dropped from the page cache afterwards if DROP_CACHE_AFTER_READ is set. Returns a dictionary of hex digests keyed by algorithm.
+def generate_hashes(file_path, strategy=None):
+    return generate_hashes_and_head(file_path, strategy)[0]
+
+# Generate hashes for a file as generate_hashes does, returning them with up to head_bytes bytes from the start of the file, taken from the first chunk read to hash it.
+def generate_hashes_and_head(file_path, strategy=None, head_bytes=0):
+    if strategy == 'direct' and hasattr(os, 'O_DIRECT'):
+        try:
+            return hash_open_file(open(os.open(file_path, os.O_RDONLY | os.O_DIRECT), 'rb', buffering=0), strategy, head_bytes)
+        except OSError as error:
+            # This file system does not support O_DIRECT, so the file is read normally instead.
+            if error.errno != errno.EINVAL:
+                raise
+    return hash_open_file(open(file_path, 'rb', buffering=0), None if strategy == 'direct' else strategy, head_bytes)
+
+# Generate hashes for a file opened for reading, closing it afterwards, and return them with up to head_bytes bytes from its first chunk.
+def hash_open_file(f, strategy, head_bytes=0):
+    hashers = {algorithm: hashlib.new(algorithm) for algorithm in HASH_ALGORITHMS}
+    head = None
+    with f:
+        for chunk in read_chunks(f, strategy):
+            if head is None:
+                head = bytes(chunk[:head_bytes])
+            for hasher in hashers.values():
+                hasher.update(chunk)
+        if DROP_CACHE_AFTER_READ:
+            drop_from_cache(f.fileno())
+    return {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}, head or b''
+
+# Return the CSV column label used for an algorithm's hashes (e.g. 'MD5', 'SHA256').
+def hash_label(algorithm):
+    return algorithm.upper()
+
+
+# Worker pools for checksum generation, one per storage device so that hashing does not overload any one disk.
+hash_pools = {}
+hash_pools_lock = threading.Lock()
+
+# Return the worker pool for a storage device, creating it on first use.
+def get_hash_pool(device):
+    with hash_pools_lock:
+        if device not in hash_pools:
+            pool_type = ProcessPoolExecutor if HASH_POOL == 'process' else ThreadPoolExecutor
+            hash_pools[device] = pool_type(max_workers=HASH_WORKERS_PER_DEVICE)
+        return hash_pools[device]
+
+# Persistent hash cache shared between runs, keyed on each file's device and inode and only reused while the file's size and modification time are unchanged. Reused entries are only marked as used, and new entries only committed, every HASH_CACHE_COMMIT_FILES files or HASH_CACHE_COMMIT_SECONDS seconds, so that looking up cached hashes never holds the cache's write lock and other runs sharing the cache are never kept waiting for long.
+hash_cache = None
+hash_cache_lock = threading.Lock()
+hash_cache_used = []
+hash_cache_stored = 0
+hash_cache_committed = 0.0
+
+# Open (creating if necessary) the hash cache at HASH_CACHE_FILE.
+def open_hash_cache():
+    global hash_cache, hash_cache_stored, hash_cache_committed
+    hash_cache = sqlite3.connect(HASH_CACHE_FILE, timeout=60, check_same_thread=False)
+    hash_cache_used.clear()
+    hash_cache_stored = 0
+    hash_cache_committed = time.time()
+    hash_cache.execute('PRAGMA journal_mode=WAL')
+    hash_cache.execute('CREATE TABLE IF NOT EXISTS file_hashes (device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, '
+                       'digests TEXT, path TEXT, last_used REAL, PRIMARY KEY (device, inode))')
+    hash_cache.execute('CREATE INDEX IF NOT EXISTS file_hashes_last_used ON file_hashes (last_used)')
+    hash_cache.execute('CREATE INDEX IF NOT EXISTS file_hashes_path ON file_hashes (path)')
+    hash_cache.execute('CREATE TABLE IF NOT EXISTS copy_throughput (source_device INTEGER, destination_device INTEGER, files INTEGER, '
+                       'bytes INTEGER, seconds REAL, recorded REAL, PRIMARY KEY (source_device, destination_device))')
+
+# Return the cached hashes for a file if its stat signature is unchanged since it was hashed and every algorithm in HASH_ALGORITHMS was generated, otherwise None.
+def lookup_cached_hashes(file_stat):
+    if hash_cache is None:
+        return None
+    key = (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+    with hash_cache_lock:
+        row = hash_cache.execute('SELECT digests FROM file_hashes WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?', key).fetchone()
+        if not row:
+            return None
+        digests = dict(item.split('=') for item in row[0].split(';'))
+        if not all(algorithm in digests for algorithm in HASH_ALGORITHMS):
+            return None
+        hash_cache_used.append((time.time(), file_stat.st_dev, file_stat.st_ino))
+        commit_hash_cache()
+    return {algorithm: digests[algorithm] for algorithm in HASH_ALGORITHMS}
+
+# Record the hashes generated for a file against the stat signature it had when it was read, committing regularly so an interrupted run keeps most of its work.
+def store_cached_hashes(file_path, file_stat, hashes):
+    global hash_cache_stored
+    if hash_cache is None:
+        return
+    digests = ';'.join(f'{algorithm}={digest}' for algorithm, digest in hashes.items())
+    with hash_cache_lock:
+        hash_cache.execute('INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns,
+                            digests, os.path.abspath(file_path), time.time()))
+        hash_cache_stored += 1
+        commit_hash_cache()
+
+# Mark the cached entries reused since the last commit as used and commit them with any new entries, once HASH_CACHE_COMMIT_FILES files have been hashed or reused or HASH_CACHE_COMMIT_SECONDS seconds have passed (or straight away if forced). Must be called holding hash_cache_lock.
+def commit_hash_cache(force=False):
+    global hash_cache_stored, hash_cache_committed
+    now = time.time()
+    if not force and len(hash_cache_used) + hash_cache_stored < HASH_CACHE_COMMIT_FILES and now - hash_cache_committed < HASH_CACHE_COMMIT_SECONDS:
+        return
+    hash_cache.executemany('UPDATE file_hashes SET last_used = ? WHERE device = ? AND inode = ?', hash_cache_used)
+    hash_cache.commit()
+    hash_cache_used.clear()
+    hash_cache_stored = 0
+    hash_cache_committed = now
+
+# Close the hash cache, evicting the least recently used entries while it holds more than HASH_CACHE_MAX_MB megabytes. Entries are all much the same size, so the number kept is estimated from the average size of an entry.
+def close_hash_cache():
+    global hash_cache
+    if hash_cache is None:
+        return
+    with hash_cache_lock:
+        commit_hash_cache(force=True)
+        page_size = hash_cache.execute('PRAGMA page_size').fetchone()[0]
+        used_pages = hash_cache.execute('PRAGMA page_count').fetchone()[0] - hash_cache.execute('PRAGMA freelist_count').fetchone()[0]
+        used_bytes = used_pages * page_size
+        if used_bytes > HASH_CACHE_MAX_MB * 1000000:
+            entries = hash_cache.execute('SELECT COUNT(*) FROM file_hashes').fetchone()[0]
+            hash_cache.execute('DELETE FROM file_hashes WHERE rowid IN '
+                               '(SELECT rowid FROM file_hashes ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                               (int(entries * HASH_CACHE_MAX_MB * 1000000 / used_bytes),))
+        hash_cache.commit()
+        hash_cache.close()
+        hash_cache = None
+
+# Remove cached hashes for a file or every file under a folder, or the entire cache if no path is given, returning the number of entries removed.
+def invalidate_hash_cache(folder_path=None):
+    with hash_cache_lock:
+        if folder_path:
+            prefix = os.path.join(os.path.abspath(folder_path), '')
+            removed = hash_cache.execute('DELETE FROM file_hashes WHERE path = ? OR substr(path, 1, ?) = ?',
+                                         (os.path.abspath(folder_path), len(prefix), prefix)).rowcount
+        else:
+            removed = hash_cache.execute('DELETE FROM file_hashes').rowcount
+        hash_cache.commit()
+    return removed
+
+# Handle the '--clear-hash-cache [path]' command, which invalidates cached hashes and exits without running the programme.
+def run_clear_hash_cache_command():
+    if '--clear-hash-cache' not in sys.argv:
+        return
+    arguments = sys.argv[sys.argv.index('--clear-hash-cache') + 1:]
+    open_hash_cache()
+    removed = invalidate_hash_cache(arguments[0] if arguments else None)
+    close_hash_cache()
+    print(f'\n Removed {removed} cached hashes.')
+    sys.exit(0)
+
+# Manifest store shared between runs: a 'runs' table describing every log recorded and, for each run, a table of its log's rows (named 'run_' and its number) with the log's columns and a flag marking mismatches. Rows are inserted in batches of STORE_BATCH_ROWS.
+manifest_store = None
+manifest_store_lock = threading.Lock()
+store_run = None
+store_run_columns = []
+store_run_batch = []
+store_run_rows = 0
+STORE_BATCH_ROWS = 1000
+
+# Open (creating if necessary) the manifest store at MANIFEST_STORE_FILE.
+def open_manifest_store():
+    global manifest_store
+    manifest_store = sqlite3.connect(MANIFEST_STORE_FILE, timeout=60, check_same_thread=False)
+    manifest_store.execute('PRAGMA journal_mode=WAL')
+    manifest_store.execute('CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY, programme TEXT, log_name TEXT, started REAL, '
+                           'columns TEXT, path_column TEXT, digest_columns TEXT, rows INTEGER)')
+    manifest_store.execute('CREATE INDEX IF NOT EXISTS runs_started ON runs (started)')
+
+# Quote a CSV column label for use as a column name in SQL.
+def quote_column(label):
+    return '"' + label.replace('"', '""') + '"'
+
+# Start recording the rows of a CSV log in the manifest store as a new run, creating its table with the log's columns. Does nothing if the store is not open.
+def start_store_run(log_path, columns, path_column, digest_columns):
+    global store_run, store_run_columns, store_run_rows
+    if manifest_store is None:
+        return
+    with manifest_store_lock:
+        store_run = manifest_store.execute('INSERT INTO runs (programme, log_name, started, columns, path_column, digest_columns, rows) '
+                                           'VALUES (?, ?, ?, ?, ?, ?, 0)',
+                                           (os.path.basename(sys.argv[0]), os.path.basename(log_path), time.time(),
+                                            '\n'.join(columns), path_column, '\n'.join(digest_columns))).lastrowid
+        store_run_columns = list(columns)
+        store_run_batch.clear()
+        store_run_rows = 0
+        manifest_store.execute(f'CREATE TABLE run_{store_run} ('
+                               + ', '.join(f'{quote_column(label)} TEXT' for label in columns) + ', mismatch INTEGER)')
+        manifest_store.commit()
+
+# Insert the batch of rows waiting to be recorded in the manifest store and commit them, so an interrupted run keeps most of its rows.
+def flush_store_batch():
+    global store_run_rows
+    manifest_store.executemany(f'INSERT INTO run_{store_run} VALUES ({", ".join("?" * (len(store_run_columns) + 1))})', store_run_batch)
+    store_run_rows += len(store_run_batch)
+    store_run_batch.clear()
+    manifest_store.commit()
+
+# Record a row of the CSV log being written (a dictionary keyed by column) in the manifest store. Does nothing if no run is being recorded.
+def store_row(row, mismatch):
+    if store_run is None:
+        return
+    with manifest_store_lock:
+        store_run_batch.append([row.get(label, '') for label in store_run_columns] + [int(mismatch)])
+        if len(store_run_batch) >= STORE_BATCH_ROWS:
+            flush_store_batch()
+
+# Finish recording the current run in the manifest store, noting how many rows it holds and indexing it on its relative path, on its checksums of the first algorithm in HASH_ALGORITHMS and on whether each row is a mismatch. Indexes are built once every row has been inserted, which is much quicker than keeping them up to date row by row.
+def finish_store_run():
+    global store_run
+    if store_run is None:
+        return
+    with manifest_store_lock:
+        flush_store_batch()
+        path_column, digest_columns = manifest_store.execute('SELECT path_column, digest_columns FROM runs WHERE run = ?', (store_run,)).fetchone()
+        for index, label in enumerate([path_column] + digest_columns.split('\n') + ['mismatch']):
+            manifest_store.execute(f'CREATE INDEX run_{store_run}_{index} ON run_{store_run} ({quote_column(label)})')
+        manifest_store.execute('UPDATE runs SET rows = ? WHERE run = ?', (store_run_rows, store_run))
+        manifest_store.commit()
+        store_run = None
+
+# Close the manifest store.
+def close_manifest_store():
+    global manifest_store
+    if manifest_store is None:
+        return
+    finish_store_run()
+    with manifest_store_lock:
+        manifest_store.close()
+        manifest_store = None
+
+# Return the runs recorded in the manifest store since a time (in seconds since the epoch), oldest first, as dictionaries of their details.
+def get_store_runs(since=0):
+    labels = ['run', 'programme', 'log_name', 'started', 'columns', 'path_column', 'digest_columns', 'rows']
+    rows = manifest_store.execute(f'SELECT {", ".join(labels)} FROM runs WHERE started >= ? ORDER BY run', (since,)).fetchall()
+    return [dict(zip(labels, row)) for row in rows]
+
+# Find every row of every run holding a checksum, yielding the run, the row's relative path and the column holding the checksum. Only the checksums of the first algorithm in HASH_ALGORITHMS are indexed, so each run is searched with one indexed query per checksum column.
+def find_digest_in_store(digest):
+    for run in get_store_runs():
+        for label in run['digest_columns'].split('\n'):
+            query = f'SELECT {quote_column(run["path_column"])} FROM run_{run["run"]} WHERE {quote_column(label)} = ?'
+            for (relative_path,) in manifest_store.execute(query, (digest.strip().lower(),)):
+                yield run, relative_path, label
+
+# Find every mismatch recorded by the runs started since a time (in seconds since the epoch), yielding the run and the row as a dictionary keyed by column.
+def find_mismatches_in_store(since):
+    for run in get_store_runs(since):
+        columns = run['columns'].split('\n')
+        query = f'SELECT {", ".join(quote_column(label) for label in columns)} FROM run_{run["run"]} WHERE mismatch = 1'
+        for row in manifest_store.execute(query):
+            yield run, dict(zip(columns, row))
+
+# Export the rows of a run to a CSV log with the same columns as the log it was recorded from, returning the number of rows written, or None if there is no such run.
+def export_store_run(run_number, output_path):
+    run = manifest_store.execute('SELECT columns FROM runs WHERE run = ?', (run_number,)).fetchone()
+    if run is None:
+        return None
+    columns = run[0].split('\n')
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        exported = 0
+        for row in manifest_store.execute(f'SELECT {", ".join(quote_column(label) for label in columns)} FROM run_{run_number} ORDER BY rowid'):
+            writer.writerow(row)
+            exported += 1
+    return exported
+
+# Usage of each manifest store command, printed if it is given a missing or invalid value.
+manifest_store_usage = {
+    '--list-runs': '--list-runs',
+    '--find-digest': '--find-digest <checksum>',
+    '--mismatches-since': '--mismatches-since <dd-mm-yyyy>',
+    '--export-run': '--export-run <run number> [output CSV path]'
+}
+
+# Return whether the values given to a manifest store command are valid: a checksum, a date as dd-mm-yyyy or a run number.
+def valid_store_arguments(command, arguments):
+    if command == '--list-runs':
+        return True
+    if not arguments:
+        return False
+    try:
+        if command == '--mismatches-since':
+            datetime.datetime.strptime(arguments[0], "%d-%m-%Y")
+        elif command == '--export-run':
+            int(arguments[0])
+    except ValueError:
+        return False
+    return True
+
+# Handle the manifest store commands, which query or export the runs recorded in the store and exit without running the programme: '--list-runs', '--find-digest <checksum>', '--mismatches-since <dd-mm-yyyy>' and '--export-run <run> [CSV path]'. A command given a missing or invalid value exits with its usage before the store is opened.
+def run_manifest_store_command():
+    command = next((command for command in manifest_store_usage if command in sys.argv), None)
+    if command is None:
+        return
+    arguments = sys.argv[sys.argv.index(command) + 1:]
+    if not valid_store_arguments(command, arguments):
+        sys.exit(f'\n Usage: python {os.path.basename(sys.argv[0])} {manifest_store_usage[command]}')
+    open_manifest_store()
+    try:
+        if command == '--list-runs':
+            for run in get_store_runs():
+                started = datetime.datetime.fromtimestamp(run['started']).strftime("%d-%m-%Y %H:%M:%S")
+                print(f" Run {run['run']} | {run['programme']} | {started} | {run['rows']} rows | {run['log_name']}")
+        elif command == '--find-digest':
+            for run, relative_path, label in find_digest_in_store(arguments[0]):
+                print(f" Run {run['run']} | {run['log_name']} | {label} | {relative_path}")
+        elif command == '--mismatches-since':
+            since = datetime.datetime.strptime(arguments[0], "%d-%m-%Y").timestamp()
+            for run, row in find_mismatches_in_store(since):
+                print(f" Run {run['run']} | {run['log_name']} | {row[run['path_column']]} | {row.get('Status', '')}")
+        else:
+            output_path = arguments[1] if len(arguments) > 1 else f'run_{arguments[0]}.csv'
+            exported = export_store_run(int(arguments[0]), output_path)
+            if exported is None:
+                sys.exit(f'\n There is no run {arguments[0]} in the manifest store.')
+            print(f'\n Exported {exported} rows of run {arguments[0]} to {output_path}.')
+    finally:
+        close_manifest_store()
+    sys.exit(0)
+
+# Return an already-completed future holding a value, so cached hashes can sit in the same queues as hashes still being generated.
+def completed_future(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+# Generate hashes for a file, returning them with the time taken in seconds.
+def generate_hashes_timed(file_path, strategy=None, head_bytes=0):
+    start = time.perf_counter()
+    file_hashes, head = generate_hashes_and_head(file_path, strategy, head_bytes)
+    return file_hashes, time.perf_counter() - start, head
+
+# Queue hash generation for a file in the worker pools, returning a future for its hashes so copying can carry on in the meantime. The generated hashes are stored in the hash cache; cached hashes are only reused if use_cache is set, so integrity checks always read the file. If a timings dictionary is given, the time taken to generate the hashes is recorded in it under timing_label before the future completes. The file is read with the given read strategy, or HASH_READ_STRATEGY. If check_head is given, it is called with the file's first MAGIC_BYTES_NEEDED bytes, taken from the first chunk read to hash it, before the future completes; cached hashes are then never used, so the file is always read.
+def queue_hashes(file_path, use_cache=True, timings=None, timing_label=None, strategy=None, check_head=None):
+    file_stat = os.stat(file_path)
+    if use_cache and check_head is None:
+        cached_hashes = lookup_cached_hashes(file_stat)
+        if cached_hashes:
+            return completed_future(cached_hashes)
+    future = Future()
+
+    def finish(done):
+        if done.exception():
+            future.set_exception(done.exception())
+            return
+        file_hashes, seconds, head = done.result()
+        if timings is not None:
+            timings[timing_label] = seconds
+        if check_head is not None:
+            check_head(head)
+        # Hand the hashes on before caching them, so that a cache that cannot be written to never leaves the copy waiting for them.
+        future.set_result(file_hashes)
+        store_cached_hashes(file_path, file_stat, file_hashes)
+    head_bytes = MAGIC_BYTES_NEEDED if check_head is not None else 0
+    get_hash_pool(file_stat.st_dev).submit(generate_hashes_timed, file_path, strategy, head_bytes).add_done_callback(finish)
+    return future
+
+# Shut down all worker pools once checksum generation is complete.
+def shutdown_hash_pools():
+    with hash_pools_lock:
+        for pool in hash_pools.values():
+            pool.shutdown()
+        hash_pools.clear()
+
+
+# Ensure there are no spaces or issue characters in filename for CSV log file by stripping directories and replacing spaces with underscores.
+def no_space_name(path):
+    return os.path.basename(os.path.normpath(path)).replace(" ", "_")
+
+
+# Clone a file's contents with the FICLONE ioctl, sharing its data blocks on a copy-on-write file system.
+def copy_with_reflink(src, dst, size):
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, 'reflink is not supported on this system')
+    # FICLONE, from linux/fs.h.
+    fcntl.ioctl(dst.fileno(), 0x40049409, src.fileno())
+
+# Copy a file's contents with os.copy_file_range, which copies inside the kernel (or server-side on some network file systems).
+def copy_with_copy_file_range(src, dst, size):
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, 'copy_file_range is not supported on this system')
+    copied = 0
+    while copied < size:
+        sent = os.copy_file_range(src.fileno(), dst.fileno(), size - copied)
+        if sent == 0:
+            break
+        copied += sent
+
+# Copy a file's contents with os.sendfile, which copies inside the kernel.
+def copy_with_sendfile(src, dst, size):
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOSYS, 'sendfile is not supported on this system')
+    copied = 0
+    while copied < size:
+        sent = os.sendfile(dst.fileno(), src.fileno(), copied, size - copied)
+        if sent == 0:
+            break
+        copied += sent
+
+kernel_copy_functions = {
+    'reflink': copy_with_reflink,
+    'copy_file_range': copy_with_copy_file_range,
+    'sendfile': copy_with_sendfile,
+}
+
+# The copy backend that last worked between each pair of storage devices (for sources already hashed, and for those that are not), so backends that fail between them are not tried again for every file.
+copy_backends_by_devices = {}
+
+# Return the copy backends to try between two storage devices, starting with the one that last worked between them. Sources that have not been hashed are only cloned, and only within one storage device; otherwise they are copied through user space, which hashes them from the same read.
+def get_copy_backends(source_device, destination_device, source_hashed):
+    backends = [backend for backend in COPY_BACKENDS if backend in kernel_copy_functions or backend == 'userspace']
+    if not source_hashed:
+        backends = [backend for backend in backends if backend == 'userspace' or (backend == 'reflink' and source_device == destination_device)]
+    if 'userspace' not in backends:
+        backends.append('userspace')
+    last_used = copy_backends_by_devices.get((source_device, destination_device, source_hashed))
+    if last_used in backends:
+        backends = backends[backends.index(last_used):]
+    return backends
+
+# Copy a file from source to destination with metadata using the fastest copy backend that works, returning the source's hashes and the backend used, and recording the file's size and the time spent reading (and hashing) the source and writing the destination in the timings dictionary. Copies made through user space generate the hashes of the source from the same chunks written to the destination, so the source is only read once; copies made by the kernel never pass through the scripts, so they are only made when the source's hashes are already cached, or when a clone saves writing the file while the source is hashed in the worker pools. Either way a future for the source's hashes is returned, and they are stored in the hash cache. If check_head is given, it is called with the first chunk of a copy through user space (or with no bytes, for an empty file).
+def copy_with_hashes(source_file, destination_file, timings, check_head=None):
+    timings['Read_Seconds'] = 0.0
+    timings['Write_Seconds'] = 0.0
+    with open(source_file, 'rb', buffering=0) as src, open(destination_file, 'wb') as dst:
+        source_stat = os.fstat(src.fileno())
+        timings['Bytes'] = source_stat.st_size
+        cached_hashes = lookup_cached_hashes(source_stat)
+        devices = (source_stat.st_dev, os.fstat(dst.fileno()).st_dev, cached_hashes is not None)
+        mark = time.perf_counter()
+        for backend in get_copy_backends(*devices):
+            if backend == 'userspace':
+                break
+            try:
+                kernel_copy_functions[backend](src, dst, source_stat.st_size)
+                break
+            except OSError:
+                # Discard anything copied before the backend failed and start again with the next one.
+                os.ftruncate(dst.fileno(), 0)
+                dst.seek(0)
+                src.seek(0)
+        copy_backends_by_devices[devices] = backend
+
+        if backend == 'userspace':
+            hashers = {algorithm: hashlib.new(algorithm) for algorithm in HASH_ALGORITHMS}
+            mark = time.perf_counter()
+            for chunk in read_chunks(src):
+                if check_head is not None:
+                    # Check the file's content from the first chunk, so this needs no extra read.
+                    check_head(chunk)
+                    check_head = None
+                for hasher in hashers.values():
+                    hasher.update(chunk)
+                read_done = time.perf_counter()
+                timings['Read_Seconds'] += read_done - mark
+                dst.write(chunk)
+                mark = time.perf_counter()
+                timings['Write_Seconds'] += mark - read_done
+            if check_head is not None:
+                # An empty file has no first chunk, so check it as having no content.
+                check_head(b'')
+            # The source has been read for the last time, having been hashed as it was copied.
+            if DROP_CACHE_AFTER_READ:
+                drop_from_cache(src.fileno())
+
+        # Force the copy to disk and drop it from the page cache, so that verifying it reads what reached storage rather than the pages just written.
+        if VERIFY_READ_MODE != 'cached':
+            dst.flush()
+            getattr(os, 'fdatasync', os.fsync)(dst.fileno())
+            drop_from_cache(dst.fileno())
+    shutil.copystat(source_file, destination_file)
+    timings['Write_Seconds'] += time.perf_counter() - mark
+
+    if backend != 'userspace':
+        if cached_hashes:
+            return completed_future(cached_hashes), backend
+        return queue_hashes(source_file, timings=timings, timing_label='Read_Seconds'), backend
+    source_hashes = {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+    store_cached_hashes(source_file, source_stat, source_hashes)
+    return completed_future(source_hashes), backend
+
+# Split a path into its folder (ending in a separator, or '' if there is none) and file name, like os.path.split but keeping the separator so that joining them back is a concatenation.
+def split_folder(path):
+    split = path.rfind(os.sep) + 1
+    if os.altsep:
+        split = max(split, path.rfind(os.altsep) + 1)
+    return path[:split], path[split:]
+
+# A manifest of files and their hashes held compactly in memory, so that millions of files can be compared or resumed without a dictionary of hex strings for every file. Rows are kept in columns: relative paths as a folder, interned so that it is held once however many files it holds, and a file name, and hashes packed as binary digests (16 bytes for MD5 rather than a 32-character string) into a single bytearray. Hashes that cannot be packed, such as blank or malformed CSV columns, are kept as text instead. Call sort() once every row has been added, so rows can be looked up by relative path, and sort_by_content() to look them up by content too.
+class Manifest:
+    __slots__ = ('folders', 'folder_index', 'folder_ids', 'names', 'digests', 'text_digests', 'digest_sizes', 'hex_lengths',
+                 'row_size', 'path_order', 'content_order')
+
+    def __init__(self):
+        self.folders = []
+        self.folder_index = {}
+        self.folder_ids = array('L')
+        self.names = []
+        self.digests = bytearray()
+        self.text_digests = {}
+        self.digest_sizes = [hashlib.new(algorithm).digest_size for algorithm in HASH_ALGORITHMS]
+        self.hex_lengths = [size * 2 for size in self.digest_sizes]
+        self.row_size = sum(self.digest_sizes)
+        self.path_order = array('L')
+        self.content_order = array('L')
+
+    def __len__(self):
+        return len(self.names)
+
+    # Add a file from its relative path and hex digests (in HASH_ALGORITHMS order), returning its row number.
+    def add(self, relative_path, hex_digests):
+        row = len(self.names)
+        folder, name = split_folder(relative_path)
+        self.folder_ids.append(self.intern_folder(folder))
+        self.names.append(name)
+        text = ''.join(hex_digests)
+        try:
+            packed = bytes.fromhex(text)
+        except ValueError:
+            packed = b''
+        # Only pack digests of the expected lengths that unpack to exactly the same text.
+        if packed.hex() != text or list(map(len, hex_digests)) != self.hex_lengths:
+            self.text_digests[row] = tuple(hex_digests)
+            packed = bytes(self.row_size)
+        self.digests += packed
+        return row
+
+    # Return the number of a folder, adding it if it is new.
+    def intern_folder(self, folder):
+        folder_id = self.folder_index.get(folder)
+        if folder_id is None:
+            folder_id = self.folder_index[folder] = len(self.folders)
+            self.folders.append(folder)
+        return folder_id
+
+    # Return the relative path of a row.
+    def path(self, row):
+        return self.folders[self.folder_ids[row]] + self.names[row]
+
+    # Return a row's hashes as a tuple of hex digests in HASH_ALGORITHMS order.
+    def hex_digests(self, row):
+        if row in self.text_digests:
+            return self.text_digests[row]
+        start = row * self.row_size
+        hex_digests = []
+        for size in self.digest_sizes:
+            hex_digests.append(self.digests[start:start + size].hex())
+            start += size
+        return tuple(hex_digests)
+
+    # Return a key for a row's content, equal for two rows only if all of their hashes are.
+    def content_key(self, row):
+        if row in self.text_digests:
+            return b'\x01' + '\x00'.join(self.text_digests[row]).encode()
+        start = row * self.row_size
+        return b'\x00' + self.digests[start:start + self.row_size]
+
+    # Sort the rows by relative path. Where a relative path appears more than once only its last row is kept, as it would be in a dictionary. Relative paths are ordered without being rebuilt, folder by folder (see add_folder_rows).
+    def sort(self):
+        # Group the rows by folder, in order of file name within each folder (and in the order they were added for the same name), noting where each folder's rows start and end.
+        order = sorted(range(len(self.names)), key=self.names.__getitem__)
+        order.sort(key=self.folder_ids.__getitem__)
+        folder_rows = {}
+        start = 0
+        for folder_id, count in sorted(Counter(self.folder_ids).items()):
+            folder_rows[folder_id] = (start, start + count)
+            start += count
+        sorted_folders = sorted(self.folders[folder_id] for folder_id in folder_rows)
+        self.path_order = array('L')
+        self.add_folder_rows('', sorted_folders, 0, len(sorted_folders), order, folder_rows)
+        del order
+
+    # Sort the rows kept by sort() by content then relative path, so that they can also be looked up by content. Only needed by a comparison, which looks for files moved or renamed.
+    def sort_by_content(self):
+        self.content_order = array('L', sorted(self.path_order, key=self.content_key))
+
+    # Add the rows within a folder (given by its relative path, ending in a separator, or '' for the top folder) to path_order in relative path order, where sorted_folders[start:end] are the folders within it. The relative paths within a subfolder all begin with its name and a separator, so the folder's files and subfolders are sorted together, each subfolder by its name and separator, and each subfolder's rows are added where it sorts.
+    def add_folder_rows(self, folder, sorted_folders, start, end, order, folder_rows):
+        first, last = folder_rows.get(self.folder_index.get(folder), (0, 0))
+        rows = order[first:last]
+        names = list(map(self.names.__getitem__, rows))
+        # Keep only the last row of a file name added more than once.
+        if len(set(names)) < len(names):
+            rows = [row for index, row in enumerate(rows) if index + 1 == len(rows) or names[index + 1] != names[index]]
+            names = list(map(self.names.__getitem__, rows))
+        index = 0
+        if start < end and sorted_folders[start] == folder:
+            start += 1
+        while start < end:
+            # The next subfolder is named by the folders within it up to their first separator.
+            remainder = sorted_folders[start][len(folder):]
+            subfolder_name = remainder[:min(remainder.find(separator) for separator in os.sep + (os.altsep or '') if separator in remainder) + 1]
+            subfolder = folder + subfolder_name
+            subfolder_end = start
+            while subfolder_end < end and sorted_folders[subfolder_end].startswith(subfolder):
+                subfolder_end += 1
+            position = bisect_left(names, subfolder_name, index)
+            self.path_order.extend(rows[index:position])
+            index = position
+            self.add_folder_rows(subfolder, sorted_folders, start, subfolder_end, order, folder_rows)
+            start = subfolder_end
+        self.path_order.extend(rows[index:])
+
+    # Return the row of a relative path, or None if it is not in the manifest.
+    def find_path(self, relative_path):
+        low, high = 0, len(self.path_order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.path(self.path_order[middle]) < relative_path:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.path_order) and self.path(self.path_order[low]) == relative_path:
+            return self.path_order[low]
+        return None
+
+    # Return the first row (in relative path order) whose content has a given key, or None if there is none.
+    def find_content(self, key):
+        low, high = 0, len(self.content_order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.content_key(self.content_order[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.content_order) and self.content_key(self.content_order[low]) == key:
+            return self.content_order[low]
+        return None
+
+# A manifest of the copies recorded in a copy journal, adding to each copy's relative source path and hashes its size, its source's modification time (in nanoseconds) and the date and time it was journaled (packed by pack_date_time), held in arrays, and its destination as a folder and a file name. Destination folders are interned like source folders, and a destination file name that is the same as the source's is not held twice. Copies that were not verified are added without hashes, so they are never resumed.
+class CopyManifest(Manifest):
+    __slots__ = ('sizes', 'mtimes', 'times', 'destination_folders', 'destination_names')
+
+    def __init__(self):
+        super().__init__()
+        self.sizes = array('q')
+        self.mtimes = array('q')
+        self.times = array('q')
+        self.destination_folders = array('L')
+        self.destination_names = []
+
+    # Add a journaled copy, returning its row number.
+    def add_copy(self, relative_path, destination_file, size, mtime_ns, hex_digests, date_time):
+        row = self.add(relative_path, hex_digests)
+        folder, name = split_folder(destination_file)
+        self.destination_folders.append(self.intern_folder(folder))
+        self.destination_names.append(self.names[row] if name == self.names[row] else name)
+        self.sizes.append(size)
+        self.mtimes.append(mtime_ns)
+        self.times.append(date_time)
+        return row
+
+    # Return the destination file of a row.
+    def destination_file(self, row):
+        return self.folders[self.destination_folders[row]] + self.destination_names[row]
+
+# Pack a date and time as logged ('%d-%m-%Y %H:%M:%S') into an integer of its digits (DDMMYYYYhhmmss), which converts back exactly without the time zone arithmetic (or strptime) that would dominate loading a journal of millions of copies. Raises ValueError if it is not a date and time as logged.
+def pack_date_time(date_time):
+    digits = date_time.replace('-', '').replace(' ', '').replace(':', '')
+    if len(date_time) != 19 or len(digits) != 14:
+        raise ValueError(date_time)
+    return int(digits)
+
+# Convert a date and time packed by pack_date_time back to a date and time as logged.
+def unpack_date_time(packed):
+    digits = f'{packed:014d}'
+    return f'{digits[0:2]}-{digits[2:4]}-{digits[4:8]} {digits[8:10]}:{digits[10:12]}:{digits[12:14]}'
+
+# Append-only journal of completed copies, one record per file flushed to disk as soon as its copy is verified, so that an interrupted copy can be resumed with '--resume'.
+copy_journal = None
+copy_journal_lock = threading.Lock()
+completed_copies = CopyManifest()
+journal_field_labels = (['Relative_SourcePath', 'Destination_File', 'Size', 'Source_Mtime_ns']
+                        + [f'Source_{hash_label(algorithm)}' for algorithm in HASH_ALGORITHMS]
+                        + [f'Destination_{hash_label(algorithm)}' for algorithm in HASH_ALGORITHMS]
+                        + ['Date_time'])
+
+# Open the copy journal. When resuming, load the copies recorded by the previous run and append to its journal; otherwise start a new journal. A journal written with different HASH_ALGORITHMS (or by an earlier version of this programme) cannot be resumed from, so a new journal is started instead.
+def open_copy_journal(journal_path, resume):
+    global copy_journal, completed_copies
+    completed_copies = CopyManifest()
+    if resume and os.path.exists(journal_path):
+        with open(journal_path, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            if next(reader, None) != journal_field_labels:
+                print('\n Journal was written with different hash algorithms or columns, starting a new copy...')
+                resume = False
+            else:
+                # Records are read as lists rather than dictionaries, as building a dictionary for each of millions of copies would dominate loading the journal.
+                dest_column = 4 + len(HASH_ALGORITHMS)
+                date_time, packed_date_time = None, None
+                for row in reader:
+                    # Ignore a final record left incomplete by a crash.
+                    if len(row) != len(journal_field_labels):
+                        continue
+                    try:
+                        size = int(row[2])
+                        mtime_ns = int(row[3])
+                        # Copies journaled in the same second share their date and time, so it is only packed once.
+                        if row[-1] != date_time:
+                            packed_date_time = pack_date_time(row[-1])
+                            date_time = row[-1]
+                    except ValueError:
+                        continue
+                    source_hashes = row[4:dest_column]
+                    # Only keep the hashes of verified copies, which are the same for the source and destination.
+                    verified = all(source_hashes) and source_hashes == row[dest_column:-1]
+                    completed_copies.add_copy(row[0], row[1], size, mtime_ns, source_hashes if verified else [],
+                                              packed_date_time)
+                completed_copies.sort()
+        if resume:
+            print(f'\n Resuming from journal with {len(completed_copies.path_order)} previously copied files...')
+    copy_journal = open(journal_path, 'a' if resume else 'w', newline='', encoding='utf-8')
+    writer = csv.writer(copy_journal)
+    if copy_journal.tell() == 0:
+        writer.writerow(journal_field_labels)
+    else:
+        # Start on a fresh line if the last record was cut short.
+        with open(journal_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                copy_journal.write('\r\n')
+
+# Append a verified copy to the journal, with the modification time its source had when it was copied, and force it to disk.
+def journal_copy(relative_path, destination_file, size, mtime_ns, source_hashes, dest_hashes, date_time):
+    with copy_journal_lock:
+        if copy_journal is None:
+            return
+        csv.writer(copy_journal).writerow([relative_path, destination_file, size, mtime_ns]
+                                          + [source_hashes[algorithm] for algorithm in HASH_ALGORITHMS]
+                                          + [dest_hashes[algorithm] for algorithm in HASH_ALGORITHMS]
+                                          + [date_time])
+        copy_journal.flush()
+        os.fsync(copy_journal.fileno())
+
+# Close the copy journal once all copies have been verified.
+def close_copy_journal():
+    global copy_journal
+    with copy_journal_lock:
+        if copy_journal is not None:
+            copy_journal.close()
+            copy_journal = None
+
+# Return the journal row of a previous copy of a file if it can be skipped on resume, otherwise None: the copy must have been verified with every algorithm, the source must still have the journaled size and modification time (so a source edited in place since it was copied is copied again) and the destination must still have the journaled size.
+def get_resumable_copy(relative_path, source_stat, destination_file):
+    row = completed_copies.find_path(relative_path)
+    if row is None or row in completed_copies.text_digests or completed_copies.destination_file(row) != destination_file:
+        return None
+    if not os.path.isfile(destination_file):
+        return None
+    size = completed_copies.sizes[row]
+    if source_stat.st_size != size or source_stat.st_mtime_ns != completed_copies.mtimes[row] or os.path.getsize(destination_file) != size:
+        return None
+    return row
+
+# Securely copy a single file: skip it if resuming and it was already copied and verified, otherwise copy it (hashing the source as it is copied), queue its verification and journal it once verified. If check_format is set, the file's content is checked against its extension from the first chunk read to copy it, or, for files copied by the kernel, to verify the copy, and any mismatch is noted in its status. Returns the file's entry for the CSV log.
+def secure_copy_file(source_file, destination_file, relative_path, check_format=False):
+    source_stat = os.stat(source_file)
+    row = get_resumable_copy(relative_path, source_stat, destination_file)
+    if row is not None:
+        hashes = completed_copies.hex_digests(row)
+        return {
+            'Source': dict(zip(HASH_ALGORITHMS, hashes)),
+            'Destination': dict(zip(HASH_ALGORITHMS, hashes)),
+            'Date_time': unpack_date_time(completed_copies.times[row]),
+            'Copy_Backend': 'resumed'
+        }
+
+    timings = {}
+    format_note = Future() if check_format else None
+    check_head = (lambda head: format_note.set_result(check_file_format(source_file, head))) if check_format else None
+    source_file_hashes, copy_backend = copy_with_hashes(source_file, destination_file, timings, check_head)
+    dest_file_hashes = queue_hashes(destination_file, use_cache=False, timings=timings, timing_label='Destination_Hash_Seconds',
+                                    strategy='direct' if VERIFY_READ_MODE == 'direct' else None,
+                                    check_head=check_head if copy_backend != 'userspace' else None)
+    current_date_time = datetime.datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+    size = os.path.getsize(destination_file)
+
+    # Journal the copy once both its source and destination hashes have been generated.
+    def journal_when_verified(_):
+        if not source_file_hashes.exception() and not dest_file_hashes.exception():
+            journal_copy(relative_path, destination_file, size, source_stat.st_mtime_ns, source_file_hashes.result(), dest_file_hashes.result(), current_date_time)
+    source_file_hashes.add_done_callback(lambda _: dest_file_hashes.add_done_callback(journal_when_verified))
+
+    return {
+        'Source': source_file_hashes,
+        'Destination': dest_file_hashes,
+        'Format_Note': format_note,
+        'Date_time': current_date_time,
+        'Copy_Backend': copy_backend,
+        'Timings': timings
+    }
+
+# Below are functions shared across use-cases that require OPEX metadata files (TMS and Koha).
+
+# Return the names of the OPEX files in a source folder, sorted, found in a single os.scandir pass so that checking each reference for its OPEX file needs no further requests to the source (which matters on network shares).
+def scan_opex_files(source_folder):
+    with os.scandir(source_folder) as entries:
+        return sorted(entry.name for entry in entries if entry.name.lower().endswith('.opex') and entry.is_file())
+
+# Return the catalogue pattern of a reference, with each run of digits replaced by '#' (e.g. 'PH.#.#' for TMS reference 'PH.681.1', '#' for a Koha barcode), so that references of the same kind can be reported together and misnamed files stand out.
+def get_reference_pattern(reference):
+    return re.sub(r'\d+', '#', reference)
+
+# Report every reference prefix missing its OPEX file at once, grouped by catalogue pattern, and abort before anything is copied. Does nothing if no OPEX files are missing.
+def report_missing_opex(missing_prefixes):
+    if not missing_prefixes:
+        return
+    patterns = {}
+    for prefix in missing_prefixes:
+        patterns.setdefault(get_reference_pattern(prefix), []).append(prefix)
+    print(f"\nError: The following {len(missing_prefixes)} reference prefixes are missing required OPEX files - obtain these files prior to rerunning this script:")
+    for pattern in sorted(patterns):
+        print(f"\n {pattern} ({len(patterns[pattern])} missing):")
+        for prefix in sorted(patterns[pattern]):
+            print(f" - {prefix}")
+    sys.exit("\nAborting due to missing metadata (OPEX) files.\n")
+
+# Below are functions shared across use-cases that require a multi-asset ('PAX') folder structure.
+
+# Mappings to support PAX folder structuring, determining what file formats there are and whether they are access/preservation formats.
+file_format_mapping = {
+    'image': ['jpeg', 'jpg', 'png', 'tiff', 'tif'],
+    'document': ['doc', 'docx', 'pdf'],
+    'audio': ['mp3', 'wav', 'aiff'],
+    'video': ['mp4', 'mkv', 'mov']
+}
+
+representation_mapping = {
+    'access': ['jpeg', 'jpg', 'png', 'pdf', 'mp3', 'mp4'],
+    'preservation': ['tiff', 'tif', 'doc', 'docx', 'wav', 'aiff', 'mkv', 'mov']
+}
+
+# Return a lookup table built from the above mappings, giving the (file format, representation folder) of each extension, so that each file is classified with a single dictionary lookup.
+def build_extension_classes():
+    representation_folders = {'access': 'Representation_Access', 'preservation': 'Representation_Preservation'}
+    extension_classes = {}
+    for file_format, extensions in file_format_mapping.items():
+        for ext in extensions:
+            extension_classes[ext] = (file_format.capitalize(), None)
+    for representation, extensions in representation_mapping.items():
+        for ext in extensions:
+            extension_classes[ext] = (extension_classes.get(ext, ('Unknown', None))[0], representation_folders[representation])
+    return extension_classes
+
+extension_classes = build_extension_classes()
+
+# Signatures found at the start of files in each mapped format, as the (offset, bytes) each file must have and the extension of the format, used to identify files from their content.
+magic_numbers = [
+    (((0, b'\xff\xd8\xff'),), 'jpg'),
+    (((0, b'\x89PNG\r\n\x1a\n'),), 'png'),
+    (((0, b'II*\x00'),), 'tif'),
+    (((0, b'MM\x00*'),), 'tif'),
+    (((0, b'%PDF-'),), 'pdf'),
+    (((0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'),), 'doc'),
+    (((0, b'PK\x03\x04'),), 'docx'),
+    (((0, b'ID3'),), 'mp3'),
+    (((0, b'\xff\xfb'),), 'mp3'),
+    (((0, b'RIFF'), (8, b'WAVE')), 'wav'),
+    (((0, b'FORM'), (8, b'AIFF')), 'aiff'),
+    (((0, b'\x1aE\xdf\xa3'),), 'mkv'),
+    (((4, b'ftypqt  '),), 'mov'),
+    (((4, b'moov'),), 'mov'),
+    (((4, b'ftyp'),), 'mp4'),
+]
+MAGIC_BYTES_NEEDED = max(offset + len(part) for signature, _ in magic_numbers for offset, part in signature)
+
+# Identify a file's format from its first bytes, returning the extension of the mapped format whose signature they match, or None.
+def identify_format_from_content(head):
+    for signature, ext in magic_numbers:
+        if all(head[offset:offset + len(part)] == part for offset, part in signature):
+            return ext
+    return None
+
+# Formats whose files may have the signature of another format without being misnamed: ISO base media files with a generic brand (e.g. 'isom' or 'mp42') are identified as mp4, but QuickTime files are often written with these brands too, so only the QuickTime brand ('qt  ') shows a '.mp4' file to be a MOV.
+compatible_formats = {
+    'mp4': ['mov']
+}
+
+# Read the first MAGIC_BYTES_NEEDED bytes of a file, so that a dry run can identify its format without copying or hashing it.
+def read_file_head(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read(MAGIC_BYTES_NEEDED)
+
+# Return the (file format, representation folder) of a file from its extension, or ('Unknown', None) if the extension is not mapped. Nothing is read, so planning copies needs no I/O.
+def classify_file(source_file):
+    return extension_classes.get(source_file.split('.')[-1].lower(), ('Unknown', None))
+
+# Identify a file with an unmapped extension, which is not copied, from its first bytes (taken from the first chunk read to hash it). Returns the file's status for the CSV log, noting its format if it is recognised.
+def identify_unmapped_file(source_file, head):
+    identified = identify_format_from_content(head)
+    if not identified:
+        return 'Unknown format, not copied'
+    return f'Unmapped extension, not copied (content is {identified})'
+
+# Check whether a file's first bytes show it to be a mapped format with a different classification from its extension's (e.g. a TIFF named '.jpg'), which places it in the wrong PAX folder. Returns a note for its status (e.g. 'content is tif'), or None if its content does not contradict its extension.
+def check_file_format(source_file, head):
+    extension = source_file.split('.')[-1].lower()
+    if extension not in extension_classes:
+        return None
+    identified = identify_format_from_content(head)
+    if not identified or extension in compatible_formats.get(identified, []):
+        return None
+    if extension_classes[identified] != extension_classes[extension]:
+        return f'content is {identified}'
+    return None
+
+# Report how many copied files had content that does not match their extension in a print statement, since they may be in the wrong PAX folder.
+def report_file_formats():
+    if copy_log_misnamed_files:
+        print(f'\n {copy_log_misnamed_files} files have content that does not match their extension and may be in the wrong PAX folder. '
+              "Their status in the CSV log notes the format of their content (e.g. 'MATCH (content is tif)').")
+
+# Distribute file into DPS-friendly multi-part asset (PAX) folder structure, returning the destination file path to copy it to (or None for unknown types). Files are classified by extension. Nothing is read or created on disk; the destination folder is created when the copy plan is executed.
+def distribute_file(source_file, filename_prefix, base_output_dir, *, legacy_nested=False):
+    file_format, representation = classify_file(source_file)
+
+    if not representation:
+        return None
+
+    if legacy_nested:
+        top_level = os.path.join(base_output_dir, filename_prefix)
+        pax_root = os.path.join(top_level, f"{filename_prefix}.pax")
+    else:
+        pax_root = os.path.join(base_output_dir, f"{filename_prefix}.pax")
+
+    destination_folder = os.path.join(pax_root, representation, file_format)
+
+    return os.path.join(destination_folder, os.path.basename(source_file))
+
+# Time spent creating destination folders since the last file was logged, which is logged against the next file.
+pending_mkdir_seconds = 0.0
+
+# Create a destination folder (and any missing parents), timing how long it takes.
+def make_folder(folder_path):
+    global pending_mkdir_seconds
+    start = time.perf_counter()
+    os.makedirs(folder_path, exist_ok=True)
+    pending_mkdir_seconds += time.perf_counter() - start
+
+# Worker pool running copies, and the slots limiting how many copies run at once on each storage device.
+copy_pool = None
+copy_slots = {}
+copy_slots_lock = threading.Lock()
+
+# Return the slot limiting copies of small or large files from ('source') or to ('destination') a storage device, creating it on first use.
+def get_copy_slot(role, device, size_class):
+    with copy_slots_lock:
+        key = (role, device, size_class)
+        if key not in copy_slots:
+            limit = LARGE_COPY_JOBS_PER_DEVICE if size_class == 'large' else SMALL_COPY_JOBS_PER_DEVICE
+            copy_slots[key] = threading.BoundedSemaphore(limit)
+        return copy_slots[key]
+
+# Queue a file (an entry from walk_files) to be securely copied in the copy pool, returning a future for its entry for the CSV log. This waits until both the source and destination devices have a free slot for a file of its size, so that walking the source folder never runs far ahead of the copies. The destination's device is looked up from its folder unless already known.
+def queue_copy(file_entry, destination_file, destination_device=None, check_format=False):
+    global copy_pool
+    if copy_pool is None:
+        copy_pool = ThreadPoolExecutor(max_workers=COPY_WORKERS)
+    if destination_device is None:
+        destination_device = os.stat(os.path.dirname(destination_file)).st_dev
+    size_class = 'large' if file_entry.st_size >= LARGE_FILE_BYTES else 'small'
+    slots = [get_copy_slot('source', file_entry.st_dev, size_class),
+             get_copy_slot('destination', destination_device, size_class)]
+    for slot in slots:
+        slot.acquire()
+
+    def run_copy():
+        try:
+            log_entry = secure_copy_file(file_entry.path, destination_file, file_entry.relative_path, check_format)
+        finally:
+            for slot in slots:
+                slot.release()
+        update_progress(file_entry.st_size)
+        return log_entry
+    return copy_pool.submit(run_copy)
+
+# Shut down the copy pool once all copies are complete.
+def shutdown_copy_pool():
+    global copy_pool
+    if copy_pool is not None:
+        copy_pool.shutdown()
+        copy_pool = None
+
+# Streaming CSV log of source/destination hashes (and the copy backend used for each file) to support hash comparison and quality assurance. Each row is written once, in walk order, with its status already computed, so the log never needs to be reread or held in memory.
+copy_log = None
+copy_log_writer = None
+copy_log_queue = deque()
+copy_log_mismatches = []
+copy_log_misnamed_files = 0
+copy_log_field_labels = (['Relative_SourcePath']
+                         + [f'Source_{hash_label(algorithm)}' for algorithm in HASH_ALGORITHMS]
+                         + [f'Destination_{hash_label(algorithm)}' for algorithm in HASH_ALGORITHMS]
+                         + ['Date_time', 'Copy_Backend', 'Status'])
+copy_log_timing_labels = ['Bytes', 'Mkdir_Seconds', 'Read_Seconds', 'Write_Seconds', 'Destination_Hash_Seconds', 'MB_per_second']
+copy_log_timings = {}
+copy_log_slowest_files = []
+
+# Compare the source and destination hashes of a file to determine its status. The file only matches if every algorithm's hashes match.
+def get_copy_status(source_hashes, dest_hashes):
+    if not source_hashes:
+        return 'Missing source hash'
+    elif not dest_hashes:
+        return 'Missing destination hash'
+    elif source_hashes != dest_hashes:
+        return 'Hash mismatch'
+    return 'MATCH'
+
+# Open the CSV log for a run and write its header, including the timing columns if LOG_TIMINGS is set, and start recording the run in the manifest store if it is open.
+def open_copy_log(csv_path):
+    global copy_log, copy_log_writer, copy_log_misnamed_files, pending_mkdir_seconds
+    copy_log = open(csv_path, 'w', newline='', encoding='utf-8')
+    copy_log_writer = csv.DictWriter(copy_log, fieldnames=copy_log_field_labels + (copy_log_timing_labels if LOG_TIMINGS else []))
+    copy_log_writer.writeheader()
+    start_store_run(csv_path, copy_log_writer.fieldnames, 'Relative_SourcePath',
+                    [f'Source_{hash_label(HASH_ALGORITHMS[0])}', f'Destination_{hash_label(HASH_ALGORITHMS[0])}'])
+    copy_log_queue.clear()
+    copy_log_mismatches.clear()
+    copy_log_misnamed_files = 0
+    copy_log_timings.clear()
+    copy_log_slowest_files.clear()
+    pending_mkdir_seconds = 0.0
+
+# Add a file's timings to its log row and to the timings kept for the end-of-run summary. Effective MB/s is the file's size over the total time spent on it.
+def add_timings_to_row(row, timings, mkdir_seconds):
+    stage_seconds = {
+        'Mkdir_Seconds': mkdir_seconds,
+        'Read_Seconds': timings.get('Read_Seconds', 0.0),
+        'Write_Seconds': timings.get('Write_Seconds', 0.0),
+        'Destination_Hash_Seconds': timings.get('Destination_Hash_Seconds', 0.0),
+    }
+    total_seconds = sum(stage_seconds.values())
+    stage_seconds['Total_Seconds'] = total_seconds
+    row['Bytes'] = timings.get('Bytes', '')
+    for label, seconds in stage_seconds.items():
+        copy_log_timings.setdefault(label, array('d')).append(seconds)
+        if label in copy_log_timing_labels:
+            row[label] = f'{seconds:.6f}'
+    row['MB_per_second'] = f"{timings['Bytes'] / 1000000 / total_seconds:.3f}" if total_seconds and 'Bytes' in timings else ''
+    # Keep only the slowest files, using a min-heap so the quickest of them is replaced first.
+    heapq.heappush(copy_log_slowest_files, (total_seconds, row['Relative_SourcePath']))
+    if len(copy_log_slowest_files) > SLOWEST_FILES_REPORTED:
+        heapq.heappop(copy_log_slowest_files)
+
+# Return 'True' once a log entry's copy has finished and every hash in it has been generated.
+def is_log_entry_ready(entry):
+    if isinstance(entry, Future):
+        if not entry.done():
+            return False
+        entry = entry.result()
+    return all(value.done() for value in entry.values() if isinstance(value, Future))
+
+# Write a log entry as a row of the CSV log (and of the run in the manifest store), keeping hold of it only if its hashes do not match. A note on the file's format (if its content does not match its extension) is added to its status in brackets, without making a verified copy a mismatch.
+def write_copy_log_row(relative_path, entry, mkdir_seconds=0.0):
+    global copy_log_misnamed_files
+    if isinstance(entry, Future):
+        entry = entry.result()
+    values = {label: value.result() if isinstance(value, Future) else value for label, value in entry.items()}
+    row = {'Relative_SourcePath': relative_path, 'Date_time': values.get('Date_time', ''), 'Copy_Backend': values.get('Copy_Backend', '')}
+    for side in ('Source', 'Destination'):
+        for algorithm in HASH_ALGORITHMS:
+            row[f'{side}_{hash_label(algorithm)}'] = values.get(side, {}).get(algorithm, '')
+    status = values.get('Status') or get_copy_status(values.get('Source'), values.get('Destination'))
+    row['Status'] = status
+    if values.get('Format_Note'):
+        row['Status'] = f"{status} ({values['Format_Note']})"
+        copy_log_misnamed_files += 1
+    if LOG_TIMINGS and values.get('Timings'):
+        add_timings_to_row(row, values['Timings'], mkdir_seconds)
+    copy_log_writer.writerow(row)
+    store_row(row, status != 'MATCH')
+    if status != 'MATCH':
+        copy_log_mismatches.append(row)
+
+# Queue a file's entry (or a future for it, while the file is being copied) for the CSV log, along with the time spent creating folders for it. Entries are written in walk order, whatever order the copies finish in, as soon as their hashes have been generated, and once LOG_QUEUE_SIZE entries are waiting the oldest is waited on, so memory use stays flat.
+def log_copy(relative_path, entry):
+    global pending_mkdir_seconds
+    # Files logged without being copied count towards progress straight away.
+    if not isinstance(entry, Future):
+        update_progress(0)
+    copy_log_queue.append((relative_path, entry, pending_mkdir_seconds))
+    pending_mkdir_seconds = 0.0
+    while copy_log_queue and (len(copy_log_queue) > LOG_QUEUE_SIZE or is_log_entry_ready(copy_log_queue[0][1])):
+        write_copy_log_row(*copy_log_queue.popleft())
+
+# Write the remaining queued entries and close the CSV log, returning the rows of any missing/corrupt files.
+def close_copy_log():
+    global copy_log
+    while copy_log_queue:
+        write_copy_log_row(*copy_log_queue.popleft())
+    copy_log.close()
+    copy_log = None
+    finish_store_run()
+    shutdown_copy_pool()
+    shutdown_hash_pools()
+    finish_progress()
+    return list(copy_log_mismatches)
+
+# A copy planned by a handler before anything is copied: the source file's entry from walk_files and the destination file to copy it to, or None if its type is unknown and it is only to be logged as missing from the destination. A planned copy without an entry only creates a destination folder (given as its destination file, ending in a path separator) that must exist even if no file is copied into it.
+PlannedCopy = namedtuple('PlannedCopy', ['entry', 'destination_file'])
+
+# Queue the hashes of a file of unknown format, which is not copied, returning a log entry whose status is worked out from the file's content if check_format is set, once it has been read to hash it.
+def log_entry_for_unknown_format(entry, check_format):
+    if not check_format:
+        return {'Source': queue_hashes(entry.path), 'Status': 'Unknown format, not copied'}
+    status = Future()
+    source_hashes = queue_hashes(entry.path, check_head=lambda head: status.set_result(identify_unmapped_file(entry.path, head)))
+    return {'Source': source_hashes, 'Status': status}
+
+# Execute a copy plan made by any handler: create each distinct destination folder once (as the first file or folder planned into it is reached, so copying starts straight away), queue every copy in the copy pool and log each file in plan order in the CSV log. For PAX structures (check_formats set), each file's content is also checked against its extension as it is copied, if IDENTIFY_FORMATS_FROM_CONTENT is set. Returns the log rows of any missing/corrupt files.
+def execute_copy_plan(plan, csv_path, check_formats=False):
+    open_copy_log(csv_path)
+    check_format = check_formats and IDENTIFY_FORMATS_FROM_CONTENT
+
+    # Devices of the destination folders created so far, so each folder is only created and stat'ed once.
+    folder_devices = {}
+
+    for entry, destination_file in plan:
+        if entry is None:
+            destination_folder = os.path.dirname(destination_file)
+            if destination_folder not in folder_devices:
+                make_folder(destination_folder)
+                folder_devices[destination_folder] = os.stat(destination_folder).st_dev
+            continue
+
+        if destination_file is None:
+            # Skip files of unknown format, logging their source hash and why they were not copied.
+            log_copy(entry.relative_path, log_entry_for_unknown_format(entry, check_format))
+            continue
+
+        destination_folder = os.path.dirname(destination_file)
+        if destination_folder not in folder_devices:
+            make_folder(destination_folder)
+            folder_devices[destination_folder] = os.stat(destination_folder).st_dev
+
+        # Copy, verify and log hash and date/time in CSV log.
+        log_copy(entry.relative_path, queue_copy(entry, destination_file, folder_devices[destination_folder], check_format))
+
+    return close_copy_log()
+
+# Report on any missing/corrupt files recorded in the CSV log in a print statement.
+def report_mismatches(mismatches):
+    if mismatches:
+        print('\n Mismatched or missing files detected:')
+        for entry in mismatches:
+            label = hash_label(HASH_ALGORITHMS[0])
+            print(f" - {entry['Relative_SourcePath']}: Source {label} = {entry[f'Source_{label}']}, "
+                  f"Destination {label} = {entry[f'Destination_{label}']}, Status = {entry['Status']}")
+    else:
+        print('\n All files copied and verified successfully.')
+
+# Return the value at a percentile (0-100) of a sorted sequence of values, using the nearest-rank method.
+def get_percentile(sorted_values, percentile):
+    rank = max(1, -(-len(sorted_values) * percentile // 100))
+    return sorted_values[int(rank) - 1]
+
+# Report the percentile latencies of each stage of copying and the slowest files in a print statement, if LOG_TIMINGS is set.
+def report_timings():
+    if not LOG_TIMINGS or not copy_log_timings:
+        return
+    print(f"\n Per-file timings in seconds over {len(copy_log_timings['Total_Seconds'])} copied files:")
+    print(f"   {'Stage':<26} {'p50':>10} {'p90':>10} {'p99':>10} {'max':>10}")
+    for label, seconds in copy_log_timings.items():
+        sorted_seconds = sorted(seconds)
+        print(f'   {label:<26} ' + ' '.join(f'{get_percentile(sorted_seconds, percentile):>10.4f}' for percentile in (50, 90, 99, 100)))
+    print(f'\n Slowest {len(copy_log_slowest_files)} files:')
+    for total_seconds, relative_path in sorted(copy_log_slowest_files, reverse=True):
+        print(f' - {relative_path}: {total_seconds:.4f} seconds')
+
+# Record the files, bytes and seconds of the copy just finished between the drives of two folders, so that dry runs can estimate how long later copies between them will take.
+def record_copy_throughput(source, destination):
+    if hash_cache is None or not completed_progress.get('seconds'):
+        return
+    with hash_cache_lock:
+        hash_cache.execute('INSERT OR REPLACE INTO copy_throughput VALUES (?, ?, ?, ?, ?, ?)',
+                           (os.stat(source).st_dev, os.stat(destination).st_dev, completed_progress['files'],
+                            completed_progress['bytes'], completed_progress['seconds'], time.time()))
+        hash_cache.commit()
+
+# Read and hash source files for up to DRY_RUN_SAMPLE_SECONDS, returning the files, bytes and seconds taken. Copying also reads and hashes every source file, so this gives the fastest a copy could run.
+def measure_source_speed(entries):
+    files = total_bytes = 0
+    start = time.perf_counter()
+    for entry in entries:
+        generate_hashes(entry.path)
+        files += 1
+        total_bytes += entry.st_size
+        if time.perf_counter() - start >= DRY_RUN_SAMPLE_SECONDS:
+            break
+    return files, total_bytes, time.perf_counter() - start
+
+# Estimate how many seconds copying a number of files and bytes from source to destination will take, from the last copy timed between the same drives or, failing that, by measuring how fast the source can be read. Returns the estimate and what it is based on.
+def estimate_copy_seconds(source, destination, entries, total_files, total_bytes):
+    row = None
+    if hash_cache is not None:
+        with hash_cache_lock:
+            row = hash_cache.execute('SELECT files, bytes, seconds FROM copy_throughput WHERE source_device = ? AND destination_device = ?',
+                                     (os.stat(source).st_dev, os.stat(destination).st_dev)).fetchone()
+    if row:
+        files, measured_bytes, seconds = row
+        basis = f'the last copy between these drives ({measured_bytes / 1000000 / seconds:.1f} MB/s)'
+    else:
+        files, measured_bytes, seconds = measure_source_speed(entries)
+        basis = f'reading {files} source files ({measured_bytes / 1000000 / seconds if seconds else 0:.1f} MB/s); no copy between these drives has been timed yet, so allow longer'
+    # Small files are limited by the number of files copied per second and large files by the bytes copied per second, so take the longer of the two estimates.
+    estimates = []
+    if measured_bytes:
+        estimates.append(total_bytes * seconds / measured_bytes)
+    if files:
+        estimates.append(total_files * seconds / files)
+    return max(estimates, default=0.0), basis
+
+# Report what a copy plan would do without copying anything: write every planned copy to a CSV report and print the number of folders and SIPs that would be created, the bytes in the largest SIPs, the files of unknown type that would be skipped, whether the destination has enough free space and an estimate of how long the copy would take. For PAX structures (check_formats set), the first bytes of each file are also read to check its content against its extension, if IDENTIFY_FORMATS_FROM_CONTENT is set, and its status notes any mismatch as the copy would. Returns 'True' if the destination has enough free space.
+def report_dry_run(plan, source, destination, report_path, check_formats=False):
+    check_format = check_formats and IDENTIFY_FORMATS_FROM_CONTENT
+    sip_files = {}
+    sip_bytes = {}
+    folders = set()
+    skipped = []
+    misnamed = []
+
+    with open(report_path, 'w', newline='', encoding='utf-8') as report:
+        writer = csv.writer(report)
+        writer.writerow(['Relative_SourcePath', 'Destination_Path', 'SIP', 'Bytes', 'Status'])
+        for entry, destination_file in plan:
+            if entry is None:
+                # Count a planned folder and any parent folders it needs.
+                folder_path = os.path.relpath(destination_file, destination)
+                while folder_path and folder_path != '.' and folder_path not in folders:
+                    folders.add(folder_path)
+                    folder_path = os.path.dirname(folder_path)
+                continue
+            if destination_file is None:
+                skipped.append(entry)
+                identified = identify_format_from_content(read_file_head(entry.path)) if check_format else None
+                status = f'Unmapped extension, would not be copied (content is {identified})' if identified else 'Unknown format, would not be copied'
+                writer.writerow([entry.relative_path, '', '', entry.st_size, status])
+                continue
+            relative_destination = os.path.relpath(destination_file, destination)
+            # Count the destination folder and any parent folders it needs.
+            folder_path = os.path.dirname(relative_destination)
+            while folder_path and folder_path not in folders:
+                folders.add(folder_path)
+                folder_path = os.path.dirname(folder_path)
+            # Each top-level destination folder is a SIP; files planned straight into the destination folder are counted under '.'.
+            sip = relative_destination.split(os.sep)[0] if os.sep in relative_destination else '.'
+            sip_files[sip] = sip_files.get(sip, 0) + 1
+            sip_bytes[sip] = sip_bytes.get(sip, 0) + entry.st_size
+            format_note = check_file_format(entry.path, read_file_head(entry.path)) if check_format else None
+            if format_note:
+                misnamed.append((entry, format_note))
+            writer.writerow([entry.relative_path, relative_destination, sip, entry.st_size, f'Would copy ({format_note})' if format_note else 'Would copy'])
+
+    total_files = sum(sip_files.values())
+    total_bytes = sum(sip_bytes.values())
+    print(f'\n Dry run: nothing has been copied. The destination would have {len(folders)} folders in {len(sip_files)} SIPs, '
+          f'with {total_files} files ({total_bytes / 1000000:.1f} MB) copied into them.')
+
+    print('\n Largest SIPs:')
+    for sip, sip_size in sorted(sip_bytes.items(), key=lambda item: item[1], reverse=True)[:DRY_RUN_SIPS_SHOWN]:
+        print(f' - {sip}: {sip_files[sip]} files, {sip_size / 1000000:.1f} MB')
+
+    if skipped:
+        print(f'\n Files of unknown format that would not be copied ({len(skipped)}):')
+        for entry in skipped:
+            print(f' - {entry.relative_path}')
+
+    if misnamed:
+        print(f'\n Files whose content does not match their extension, which would be in the wrong PAX folder ({len(misnamed)}):')
+        for entry, format_note in misnamed:
+            print(f' - {entry.relative_path}: {format_note}')
+
+    # Copies to a copy-on-write file system may take less space than this, and files already at the destination are not subtracted.
+    free_bytes = shutil.disk_usage(destination).free
+    enough_space = free_bytes >= total_bytes
+    print(f'\n Destination free space: {free_bytes / 1000000:.1f} MB, {total_bytes / 1000000:.1f} MB needed.')
+    if not enough_space:
+        print(f' Warning: the destination is {(total_bytes - free_bytes) / 1000000:.1f} MB short of the space needed.')
+
+    seconds, basis = estimate_copy_seconds(source, destination, (entry for entry, _ in plan if entry is not None), total_files, total_bytes)
+    print(f' Estimated copy time: {datetime.timedelta(seconds=round(seconds))}, based on {basis}.')
+
+    print(f'\n Every planned copy has been written to {report_path}')
+    return enough_space
@@ -1,178 +1,154 @@
-import os.path
-import re
-import sys
-import csv
-import datetime
-import shutil
-
-# Import key shared function (hash generation, file distribution) from structure_SIPs_utils.py.
-from structure_SIPs_utils import (
-    generate_md5,
-    distribute_file
-)
-
-# Identify TMS reference numbers in filename prefix for OPEX validation.
-def get_folder_names_tms_std(source_path):
-    # Match a prefix ending with digits, possibly followed by a single lowercase letter
-    match = re.match(r'^(.*\D)?(\d+)[a-z]?$', '.'.join(source_path.split('.')[:-1]))
-    if match:
-        prefix_base, number = match.groups()
-        return f"{prefix_base}{number}"
-    else:
-        return '.'.join(source_path.split('.')[:-1])
-
-
-# Identify amended TMS PAX reference numbers in filename prefix in order to create parent folders based on these prefixes.
-def get_parent_folder_names_tms_pax(source_path):
-    # Match lowercase letter before the final dot (e.g., abcD.txt → match 'c')
-    match = re.search(r'([a-z])(?=\.[^.]+$)', source_path)
-    if match:
-        cutoff_index = match.start()
-        return source_path[:cutoff_index]
-    else:
-        base = '.'.join(source_path.split('.')[:-1])
-    return f'{base}.pax'
-
-
-# Ensure that an OPEX file is present and corresponds to any unique TMS reference numbers found using sets.
-def validate_opex_files_pax(source_folder, file_list, destination_folder):
-    unique_prefixes = set()
-
-    for file_path in file_list:
-        filename = os.path.basename(file_path)
-
-        if not filename.lower().endswith('.opex'):
-            prefix = get_folder_names_tms_std(filename)
-            unique_prefixes.add(prefix)
-
-    opex_files = [f for f in os.listdir(source_folder)
-                  if f.lower().endswith('.opex') and os.path.isfile(os.path.join(source_folder, f))]
-
-    valid_opex_prefixes = set()
-
-    for opex in opex_files:
-        base = opex[:-5]  # strip '.opex'
-
-        # Meet use-cases where OPEX file is in a ranged format by identifying presence of hyphen.
-        if '-' in base:
-            match = re.match(r'^(.*?)(\d+)-(\d+)$', base)
-            if match:
-                prefix_part, start_str, end_str = match.groups()
-                start, end = int(start_str), int(end_str)
-                for i in range(start, end + 1):
-                    valid_opex_prefixes.add(f"{prefix_part}{i}")
-            else:
-                print(f'Warning: Could not parse OPEX range file {opex}')
-
-        else:
-            valid_opex_prefixes.add(base)
-
-    missing_opex = []
-
-    for prefix in unique_prefixes:
-        if prefix not in valid_opex_prefixes:
-            missing_opex.append(prefix)
-            continue
-
-    if missing_opex:
-        print('\nError: The following reference prefixes are missing required OPEX files:')
-        for prefix in missing_opex:
-            print(f' - {prefix}')
-        sys.exit('\nAborting due to missing metadata (OPEX) files.\n')
-
-    for opex in opex_files:
-        folder_name = os.path.splitext(opex)[0]
-        folder_path = os.path.join(destination_folder, folder_name)
-        os.makedirs(folder_path, exist_ok=True)
-
-
-# Securely reorganise content into Preservica-friendly folder structures from input path, logging progress through MD5 hash generation and date/time of completion for each file along the way.
-
-def secure_copy(path1, path2, csv_path):
-
-    opex_files = [f for f in os.listdir(path1)
-        if f.lower().endswith('.opex') and os.path.isfile(os.path.join(path1, f))]
-
-    exact_opex_prefixes = set()
-    ranged_groups = []
-
-    for opex in opex_files:
-        base = opex[:-5]
-        if '-' in base:
-            m = re.match(r'^(.*?)(\d+)-(\d+)$', base)
-            if m:
-                prefix_part, start_str, end_str = m.groups()
-                ranged_groups.append((base, prefix_part, int(start_str), int(end_str)))
-        else:
-            exact_opex_prefixes.add(base)
-
-    # Account for cases where OPEX files cover a range of discrete reference number.
-    group_parent_map = {}  # {"PH.681.1": "PH.681.1-3", ...}
-    for group_label, prefix_part, start, end in ranged_groups:
-        for i in range(start, end + 1):
-            indiv = f"{prefix_part}{i}"
-            if indiv not in exact_opex_prefixes:
-                group_parent_map[indiv] = group_label
-
-    source_data = {}
-    with open(csv_path, 'r', newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            source_data[row['Relative_SourcePath']] = {
-                'Source_MD5': row['Source_MD5']
-            }
-
-    for root, _, files in os.walk(path1):
-        for f in files:
-            source_file = os.path.join(root, f)
-            relative_path = os.path.relpath(source_file, path1)
-            ext = f.split('.')[-1].lower()
-
-            item_prefix = get_parent_folder_names_tms_pax(f).replace('.pax', '')
-
-            if ext == 'opex':
-                parent_label = item_prefix
-            else:
-                parent_label = group_parent_map.get(item_prefix, item_prefix)
-
-            parent_folder = os.path.join(path2, parent_label)
-            os.makedirs(parent_folder, exist_ok=True)
-
-            # Determine correct parent folder for any opex files.
-            if ext == 'opex':
-                destination_file = os.path.join(parent_folder, f)
-                shutil.copy2(source_file, destination_file)
-            else:
-                dest_folder = distribute_file(source_file, item_prefix, parent_folder)
-                if dest_folder is None:
-                    continue
-                destination_file = os.path.join(dest_folder, f)
-
-            # Verify and log hash and date/time in CSV log.
-            dest_file_hash = generate_md5(destination_file)
-            current_date_time = datetime.datetime.now().strftime("%d-%m-%Y %H:%M:%S")
-
-            if relative_path in source_data:
-                source_data[relative_path].update({
-                    'Destination_MD5': dest_file_hash,
-                    'Date_time': current_date_time
-                })
-            else:
-                source_data[relative_path] = {
-                    'Source_MD5': '',
-                    'Destination_MD5': dest_file_hash,
-                    'Date_time': current_date_time
-                }
-
-# Write updated CSV log to support hash comparison and quality assurance.
-    with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
-        field_labels = ['Relative_SourcePath', 'Source_MD5', 'Destination_MD5', 'Date_time']
-        writer = csv.DictWriter(csvfile, fieldnames=field_labels)
-        writer.writeheader()
-        for path, data in source_data.items():
-            writer.writerow({
-                'Relative_SourcePath': path,
-                'Source_MD5': data.get('Source_MD5', ''),
-                'Destination_MD5': data.get('Destination_MD5', ''),
-                'Date_time': data.get('Date_time', '')
-            })
\ No newline at end of file
+import os.path
+import re
+import bisect
+from collections import namedtuple
+
+# Import key shared function (hash generation, file distribution) from structure_SIPs_utils.py.
+from structure_SIPs_utils import (
+    PlannedCopy,
+    walk_files,
+    execute_copy_plan,
+    scan_opex_files,
+    report_missing_opex,
+    distribute_file
+)
+
+# Identify TMS reference numbers in filename prefix for OPEX validation.
+def get_folder_names_tms_std(source_path):
+    # Match a prefix ending with digits, possibly followed by a single lowercase letter
+    match = re.match(r'^(.*\D)?(\d+)[a-z]?$', '.'.join(source_path.split('.')[:-1]))
+    if match:
+        prefix_base, number = match.groups()
+        return f"{prefix_base}{number}"
+    else:
+        return '.'.join(source_path.split('.')[:-1])
+
+
+# Identify amended TMS PAX reference numbers in filename prefix in order to create parent folders based on these prefixes.
+def get_parent_folder_names_tms_pax(source_path):
+    # Match lowercase letter before the final dot (e.g., abcD.txt → match 'c')
+    match = re.search(r'([a-z])(?=\.[^.]+$)', source_path)
+    if match:
+        cutoff_index = match.start()
+        return source_path[:cutoff_index]
+    else:
+        base = '.'.join(source_path.split('.')[:-1])
+    return f'{base}.pax'
+
+
+# Index of the OPEX files in a source folder, built from a single scan and shared by validation and copying: the OPEX filenames, the reference prefixes with an OPEX file of their own, and the ranged OPEX files (e.g. PH.681.1-300.opex) as intervals of reference numbers for each prefix (e.g. 'PH.681.'). Each prefix's intervals are kept sorted by their start, with the starts in a separate list so that a reference number is found by bisect without ever expanding a range.
+OpexIndex = namedtuple('OpexIndex', ['opex_files', 'exact_prefixes', 'range_starts', 'ranges'])
+opex_indexes = {}
+
+# Return the OPEX index of a source folder, scanning the folder the first time it is needed. Where ranges overlap, the numbers they share belong to the range starting first.
+def get_opex_index(source_folder):
+    if source_folder in opex_indexes:
+        return opex_indexes[source_folder]
+
+    opex_files = scan_opex_files(source_folder)
+
+    exact_prefixes = set()
+    ranged_groups = {}
+
+    for opex in opex_files:
+        base = opex[:-5]  # strip '.opex'
+
+        # Meet use-cases where OPEX file is in a ranged format by identifying presence of hyphen.
+        if '-' in base:
+            match = re.match(r'^(.*?)(\d+)-(\d+)$', base)
+            if match:
+                prefix_part, start_str, end_str = match.groups()
+                ranged_groups.setdefault(prefix_part, []).append((int(start_str), int(end_str), base))
+            else:
+                print(f'Warning: Could not parse OPEX range file {opex}')
+
+        else:
+            exact_prefixes.add(base)
+
+    range_starts = {}
+    ranges = {}
+    for prefix_part, intervals in ranged_groups.items():
+        ranges[prefix_part] = []
+        for start, end, group_label in sorted(intervals):
+            if ranges[prefix_part] and start <= ranges[prefix_part][-1][1]:
+                print(f'Warning: OPEX range file {group_label}.opex overlaps {ranges[prefix_part][-1][2]}.opex')
+                start = ranges[prefix_part][-1][1] + 1
+            if start <= end:
+                ranges[prefix_part].append((start, end, group_label))
+        range_starts[prefix_part] = [start for start, _, _ in ranges[prefix_part]]
+
+    opex_indexes[source_folder] = OpexIndex(opex_files, exact_prefixes, range_starts, ranges)
+    return opex_indexes[source_folder]
+
+# Return the label of the ranged OPEX file covering a TMS reference number (e.g. 'PH.681.1-300' for 'PH.681.25'), or None if no range covers it.
+def find_opex_range(opex_index, reference):
+    match = re.match(r'^(.*\D)?(\d+)$', reference)
+    if not match:
+        return None
+    prefix_part, number_str = match.groups()
+    prefix_part = prefix_part or ''
+    number = int(number_str)
+    # Numbers in a range are written without leading zeros, so e.g. 'PH.681.025' is not covered by 'PH.681.1-300'.
+    if number_str != str(number) or prefix_part not in opex_index.range_starts:
+        return None
+    i = bisect.bisect_right(opex_index.range_starts[prefix_part], number) - 1
+    if i >= 0:
+        _, end, group_label = opex_index.ranges[prefix_part][i]
+        if number <= end:
+            return group_label
+    return None
+
+# Ensure that an OPEX file is present and corresponds to any unique TMS reference numbers found using sets.
+def validate_opex_files_pax(source_folder, file_list):
+    unique_prefixes = set()
+
+    for file_path in file_list:
+        filename = os.path.basename(file_path)
+
+        if not filename.lower().endswith('.opex'):
+            prefix = get_folder_names_tms_std(filename)
+            unique_prefixes.add(prefix)
+
+    opex_index = get_opex_index(source_folder)
+
+    missing_opex = [prefix for prefix in unique_prefixes
+                    if prefix not in opex_index.exact_prefixes and find_opex_range(opex_index, prefix) is None]
+    report_missing_opex(missing_opex)
+
+
+# Plan where every file from the input path will be copied to before anything is copied, returning the plan as a list of planned copies in walk order, after a folder for every OPEX file. Files are taken from the entries already found by walk_files if given.
+def plan_copies(path1, path2, entries=None):
+    # Account for cases where OPEX files cover a range of discrete reference numbers, using the OPEX index shared with validation.
+    opex_index = get_opex_index(path1)
+
+    # Plan a destination folder for each OPEX file, to be created by the executor along with every other destination folder.
+    plan = [PlannedCopy(None, os.path.join(path2, os.path.splitext(opex)[0], '')) for opex in opex_index.opex_files]
+
+    for entry in entries if entries is not None else walk_files(path1):
+        f = os.path.basename(entry.path)
+        ext = f.split('.')[-1].lower()
+
+        item_prefix = get_parent_folder_names_tms_pax(f).replace('.pax', '')
+
+        if ext == 'opex' or item_prefix in opex_index.exact_prefixes:
+            parent_label = item_prefix
+        else:
+            parent_label = find_opex_range(opex_index, item_prefix) or item_prefix
+
+        parent_folder = os.path.join(path2, parent_label)
+
+        # Determine correct parent folder for any opex files.
+        if ext == 'opex':
+            destination_file = os.path.join(parent_folder, f)
+        else:
+            # Distribute by representation + media type (unknown types are planned with no destination).
+            destination_file = distribute_file(entry.path, item_prefix, parent_folder)
+
+        plan.append(PlannedCopy(entry, destination_file))
+
+    return plan
+
+
+# Securely reorganise content into Preservica-friendly folder structures from input path, logging progress through hash generation and date/time of completion for each file along the way, returning the log rows of any missing/corrupt files. Files are taken from the entries already found by walk_files if given.
+def secure_copy(path1, path2, csv_path, entries=None):
+    return execute_copy_plan(plan_copies(path1, path2, entries), csv_path, check_formats=True)